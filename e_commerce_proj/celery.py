@@ -3,6 +3,10 @@ import os
 from celery import Celery
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'e_commerce_proj.settings')
+# Workers skip Django's system checks at boot: the URL checks import every view, DRF
+# and its renderers, none of which tasks need. `manage.py check` runs them on deploy;
+# set CELERY_SKIP_CHECKS= (empty) to run them in workers too.
+os.environ.setdefault('CELERY_SKIP_CHECKS', '1')
 
 app = Celery('e_commerce_proj')
 app.config_from_object('django.conf:settings', namespace='CELERY')
@@ -0,0 +1,194 @@
+"""
+Per-request timing: SQL, encryption and serializer time plus total latency,
+reported in a Server-Timing header and kept in rolling per-endpoint windows.
+Streaming responses are measured up to the point the response is returned,
+not until the last chunk is sent.
+"""
+import cProfile
+import functools
+import os
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.timings = defaultdict(float)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.timings['db'] += time.perf_counter() - start
+
+
+def install_query_recorder(connection, **kwargs):
+    # Every connection reports to whichever request is current. Connections are per
+    # thread, and the async ORM runs its queries on a thread of its own, so wrapping
+    # only the request thread's connections would miss them. Inserted first so it is
+    # never the one popped by a caller's connection.execute_wrapper() block.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+def record_timing(name, seconds):
+    """Add ``seconds`` to the ``name`` bucket of the request being served, if any."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.timings[name] += seconds
+
+
+class timed:
+    """
+    Context manager/decorator form of record_timing. One instance is shared by
+    every call it decorates, so start times live on a per-thread stack; nested
+    calls (a serializer's nested fields) count once, in the outermost one.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.local = threading.local()
+
+    def __enter__(self):
+        starts = self.local.__dict__.setdefault('starts', [])
+        starts.append(time.perf_counter())
+
+    def __exit__(self, *exc):
+        start = self.local.starts.pop()
+        if not self.local.starts:
+            record_timing(self.name, time.perf_counter() - start)
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class EndpointStats:
+    """The last REQUEST_METRICS_WINDOW samples of every endpoint."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, endpoint, sample):
+        with self.lock:
+            if endpoint not in self.samples:
+                self.samples[endpoint] = deque(maxlen=settings.REQUEST_METRICS_WINDOW)
+            self.samples[endpoint].append(sample)
+
+    def summary(self):
+        with self.lock:
+            snapshot = {endpoint: list(samples) for endpoint, samples in self.samples.items()}
+        return {endpoint: summarize(samples) for endpoint, samples in snapshot.items()}
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+
+def summarize(samples):
+    summary = {'count': len(samples)}
+    for name in ('total', 'db', 'crypto', 'serialize'):
+        values = sorted(sample.get(name, 0.0) for sample in samples)
+        if len(values) > 1:
+            cuts = statistics.quantiles(values, n=100, method='inclusive')
+            summary[name] = {'p50_ms': round(cuts[49], 3), 'p95_ms': round(cuts[94], 3), 'p99_ms': round(cuts[98], 3)}
+        else:
+            value = round(values[0], 3)
+            summary[name] = {'p50_ms': value, 'p95_ms': value, 'p99_ms': value}
+    summary['queries_mean'] = round(statistics.mean(sample['queries'] for sample in samples), 2)
+    return summary
+
+
+endpoint_stats = EndpointStats()
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profiler = None
+        if settings.REQUEST_PROFILE_SAMPLE_RATE and random.random() < settings.REQUEST_PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+        with self.collect(profiler) as metrics:
+            response = self.get_response(request)
+        return self.report(request, response, metrics, profiler)
+
+    async def __acall__(self, request):
+        # No cProfile here: it profiles a whole thread, and the event loop's thread
+        # interleaves every request in flight
+        with self.collect() as metrics:
+            response = await self.get_response(request)
+        return self.report(request, response, metrics)
+
+    @contextmanager
+    def collect(self, profiler=None):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield metrics
+        finally:
+            if profiler:
+                profiler.disable()
+            _current.reset(token)
+            metrics.timings['total'] = time.perf_counter() - start
+
+    def report(self, request, response, metrics, profiler=None):
+        sample = {name: seconds * 1000 for name, seconds in metrics.timings.items()}
+        sample['queries'] = metrics.queries
+        response['Server-Timing'] = ', '.join(
+            [f'db;dur={sample.get("db", 0.0):.2f};desc="{metrics.queries} queries"']
+            + [f'{name};dur={sample[name]:.2f}' for name in ('crypto', 'serialize') if name in sample]
+            + [f'total;dur={sample["total"]:.2f}']
+        )
+
+        match = request.resolver_match
+        endpoint = f'{request.method} /{match.route}' if match else f'{request.method} <unresolved>'
+        endpoint_stats.add(endpoint, sample)
+
+        if profiler and sample['total'] >= settings.REQUEST_PROFILE_SLOW_MS:
+            self.dump_profile(profiler, endpoint)
+        return response
+
+    def dump_profile(self, profiler, endpoint):
+        os.makedirs(settings.REQUEST_PROFILE_DIR, exist_ok=True)
+        slug = ''.join(c if c.isalnum() else '_' for c in endpoint).strip('_')
+        profiler.dump_stats(os.path.join(settings.REQUEST_PROFILE_DIR, f'{time.time():.3f}-{slug}.prof'))
@@ -13,12 +13,16 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 
 import os
+import sys
 from datetime import timedelta
 from django.contrib.messages import constants as messages
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# `manage.py test` runs Celery tasks in-process and builds the tables from the models
+TESTING = sys.argv[1:2] == ['test']
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -57,6 +61,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'e_commerce_proj.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -99,12 +104,58 @@ WSGI_APPLICATION = 'e_commerce_proj.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE_ENGINE picks the profile: 'sqlite' (default) or 'postgresql'.
+DATABASE_ENGINE = os.getenv('DATABASE_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgresql':
+    def postgres_database(host):
+        database = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB', 'e_commerce'),
+            'USER': os.getenv('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': host,
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            'CONN_HEALTH_CHECKS': True,
+        }
+        if os.getenv('DATABASE_POOL_MAX_SIZE'):
+            # Django's psycopg pool (needs psycopg[pool]); it replaces persistent connections
+            database['OPTIONS'] = {'pool': {
+                'min_size': int(os.getenv('DATABASE_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.getenv('DATABASE_POOL_MAX_SIZE')),
+                'timeout': 10,
+            }}
+        else:
+            database['CONN_MAX_AGE'] = int(os.getenv('DATABASE_CONN_MAX_AGE', 60))
+        return database
+
+    DATABASES = {'default': postgres_database(os.getenv('POSTGRES_HOST', 'localhost'))}
+    if os.getenv('POSTGRES_REPLICA_HOST'):
+        DATABASES['replica'] = postgres_database(os.getenv('POSTGRES_REPLICA_HOST'))
+        DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+else:
+    # WAL lets readers run alongside the Celery workers' writes; IMMEDIATE takes the write
+    # lock at BEGIN so a transaction waits out busy_timeout instead of failing on upgrade.
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA busy_timeout=20000;'
+                    'PRAGMA mmap_size=134217728;'
+                    'PRAGMA temp_store=MEMORY'
+                ),
+            },
+        }
     }
-}
+
+# Product list and CSV export reads go to the 'replica' alias when one is configured
+DATABASE_ROUTERS = ['e_commerce_proj.db_routers.ReadReplicaRouter']
 
 
 # Password validation
@@ -150,7 +201,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'products.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -164,14 +215,34 @@ AUTH_USER_MODEL = 'products.UserProfile'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
-# Ensure the 'videos/' subdirectory exists within the media directory
+# Directories under MEDIA_ROOT are created on first write (storage saves, uploads, transcodes).
+# Resumable uploads and transcodes are staged here before moving into the video storage.
 VIDEO_UPLOAD_PATH = os.path.join(MEDIA_ROOT, 'videos/')
-if not os.path.exists(VIDEO_UPLOAD_PATH):
-    os.makedirs(VIDEO_UPLOAD_PATH)
+
+# Product videos, renditions and posters go to the 'videos' storage (products.storage): local
+# disk under MEDIA_ROOT, or products.storage.S3VideoStorage for an S3-compatible bucket
+# (`pip install boto3`; credentials from the AWS_* variables)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'videos': {'BACKEND': os.getenv('VIDEO_STORAGE_BACKEND', 'products.storage.LocalVideoStorage')},
+}
+VIDEO_S3_BUCKET = os.getenv('VIDEO_S3_BUCKET')
+# For S3-compatible stores such as MinIO or Ceph; unset for AWS
+VIDEO_S3_ENDPOINT_URL = os.getenv('VIDEO_S3_ENDPOINT_URL')
+VIDEO_S3_REGION = os.getenv('VIDEO_S3_REGION')
+# Lifetime in seconds of the presigned URLs that playback redirects to
+VIDEO_S3_URL_EXPIRY = 3600
+# Let the front proxy send local video files instead of Python: 'x-accel-redirect' (nginx, with an
+# internal location VIDEO_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile' (Apache, lighttpd)
+VIDEO_SENDFILE = os.getenv('VIDEO_SENDFILE', '')
+VIDEO_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+# Bytes per read when Python streams a byte range itself
+VIDEO_STREAM_CHUNK_SIZE = 256 * 1024
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'products.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -182,13 +253,158 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': True,
+    # Tokens carry the user's role so API requests authenticate without a user query
+    'TOKEN_OBTAIN_SERIALIZER': 'products.serializers.RoleTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'products.serializers.RoleTokenRefreshSerializer',
 }
+# Seconds a user's role and active flag are cached for token checks; changes made
+# through the ORM clear it at once in this process, other processes catch up within the TTL
+AUTH_USER_CACHE_TTL = 60
 
 
 # Celery Configuration Options
-CELERY_BROKER_URL = 'amqp://localhost'  
-CELERY_RESULT_BACKEND = 'django-db'  
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'amqp://localhost')
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'django-db')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
-CELERY_TIMEZONE = 'UTC'
\ No newline at end of file
+CELERY_TIMEZONE = 'UTC'
+# Results are only stored for tasks that opt in (the chord parts of dummy product generation);
+# video and generation state lives on the products themselves.
+CELERY_TASK_IGNORE_RESULT = True
+# Stored results are deleted after a day by celery.backend_cleanup, which beat schedules daily
+CELERY_RESULT_EXPIRES = timedelta(days=1)
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+# Long tasks get their own queues so they never hold up short ones. Prefetching is per
+# worker, so run one worker per queue:
+#   celery -A e_commerce_proj worker -Q default -l info
+#   celery -A e_commerce_proj worker -Q bulk -c 2 --prefetch-multiplier 1 -l info
+#   celery -A e_commerce_proj worker -Q video -c <cores / FFMPEG_THREADS> --prefetch-multiplier 1 -l info
+CELERY_TASK_ROUTES = {
+    'products.tasks.process_video': {'queue': 'video'},
+    'products.tasks.generate_dummy_*': {'queue': 'bulk'},
+    'products.tasks.finish_dummy_products': {'queue': 'bulk'},
+    'products.tasks.reencrypt_*': {'queue': 'bulk'},
+}
+# The default for workers started without --prefetch-multiplier
+CELERY_WORKER_PREFETCH_MULTIPLIER = 4
+
+# CELERY_PROFILE=memory runs tasks in-process with an in-memory broker and no result
+# database, for tests and local runs without RabbitMQ.
+if os.getenv('CELERY_PROFILE') == 'memory' or TESTING:
+    CELERY_BROKER_URL = 'memory://'
+    CELERY_RESULT_BACKEND = 'cache+memory://'
+    CELERY_TASK_ALWAYS_EAGER = True
+    CELERY_TASK_EAGER_PROPAGATES = True
+
+# Dummy product generation
+PRODUCT_GENERATION_BATCH_SIZE = 1000
+
+# Rows fetched per keyset page by the streaming CSV export
+PRODUCT_EXPORT_CHUNK_SIZE = 2000
+
+
+# Field encryption keys, by key id. Ciphers are derived once per process (see products.utils.get_cipher)
+ENCRYPTION_KEYS = {
+    'default': os.getenv('ENCRYPTION_KEY'),
+}
+# Keys rotated out of ENCRYPTION_KEYS, newest first (comma-separated in ENCRYPTION_PREVIOUS_KEYS).
+# They only decrypt, until `manage.py rotate_encryption_key` has re-encrypted their rows.
+ENCRYPTION_PREVIOUS_KEYS = {
+    'default': [key for key in os.getenv('ENCRYPTION_PREVIOUS_KEYS', '').split(',') if key],
+}
+# Key rotation: ids per Celery task, and rows re-encrypted per transaction within it
+ENCRYPTION_ROTATION_CHUNK_SIZE = 50000
+ENCRYPTION_ROTATION_BATCH_SIZE = 500
+# Batches at least this large are spread over a thread pool when ENCRYPTION_THREADS > 1
+ENCRYPTION_THREADS = int(os.getenv('ENCRYPTION_THREADS', 0))
+ENCRYPTION_PARALLEL_THRESHOLD = 512
+
+# HMAC key for the blind indexes on encrypted fields; derived from the default encryption key when unset,
+# which is only allowed until that key is first rotated
+BLIND_INDEX_KEY = os.getenv('BLIND_INDEX_KEY')
+BLIND_INDEX_MIN_PREFIX = 3
+BLIND_INDEX_MAX_PREFIX = 12
+
+# Full-text product search (products.search): a local SQLite FTS5 index of the decrypted
+# titles and descriptions. It holds product text in the clear, so keep it on protected storage.
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', os.path.join(BASE_DIR, 'search_index.sqlite3'))
+SEARCH_MAX_LIMIT = 100
+SEARCH_MAX_OFFSET = 1000
+
+# Caches. Video progress is written by Celery workers and read by the web tier,
+# so production needs a shared backend (set REDIS_URL); local memory is per process.
+# The 'api' alias holds decrypted API payloads (products.cache). It is only used when shared:
+# with local memory, reads are built fresh (ETags and 304s still work).
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        },
+        'api': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+            'KEY_PREFIX': 'api',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'api': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'api',
+        },
+    }
+API_CACHE_ALIAS = 'api'
+API_CACHE_TIMEOUT = 300
+# Bump when serialized payloads change shape so old entries are never served
+API_CACHE_KEY_PREFIX = 'v1'
+
+# Seconds between video_progress writes to the database; every change is still published to the cache
+VIDEO_PROGRESS_INTERVAL = 5
+VIDEO_PROGRESS_CACHE_TTL = 60 * 60
+
+# Pub/sub carrying video progress to the SSE streams (products.pubsub). Streams in other
+# processes than the worker only see events through Redis; without it an in-process broker is used.
+PUBSUB_BROKER_URL = os.getenv('REDIS_URL')
+PUBSUB_CHANNEL = 'video-progress'
+# Seconds between keepalive comments on an idle stream, and the most products one stream may watch
+SSE_KEEPALIVE_INTERVAL = 15
+SSE_MAX_PRODUCTS = 100
+
+# Largest video accepted by the upload endpoints and process_video
+VIDEO_MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+# Bytes read from the request per write while appending an upload chunk
+VIDEO_UPLOAD_BUFFER_SIZE = 64 * 1024
+
+# Video transcoding
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+FFPROBE_BINARY = os.getenv('FFPROBE_BINARY', 'ffprobe')
+# Threads per ffmpeg process; worker concurrency times this should not exceed the node's cores
+FFMPEG_THREADS = int(os.getenv('FFMPEG_THREADS', 2))
+VIDEO_POSTER_AT = 1.0
+VIDEO_RENDITIONS = [
+    {'name': '720p', 'height': 720, 'video_bitrate': '2500k'},
+    {'name': '480p', 'height': 480, 'video_bitrate': '1000k'},
+]
+
+# Request instrumentation (e_commerce_proj.instrumentation)
+# Samples kept per endpoint for the rolling percentiles at api/metrics/requests/
+REQUEST_METRICS_WINDOW = 1000
+# Fraction of requests run under cProfile; those slower than REQUEST_PROFILE_SLOW_MS are dumped
+REQUEST_PROFILE_SAMPLE_RATE = float(os.getenv('REQUEST_PROFILE_SAMPLE_RATE', 0))
+REQUEST_PROFILE_SLOW_MS = 500
+REQUEST_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Operations written per transaction by the bulk product endpoint
+PRODUCT_BULK_CHUNK_SIZE = 1000
+
+# Products per list on the staff/agent dashboards
+DASHBOARD_PAGE_SIZE = 25
+
+if TESTING:
+    # No products migrations are committed; create its tables straight from the models
+    MIGRATION_MODULES = {'products': None}
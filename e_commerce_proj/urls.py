@@ -21,12 +21,16 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .views import RequestMetricsView, CacheMetricsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
 
     # path('auth/', include('djoser.urls')),
     # path('auth/', include('djoser.urls.jwt')),
     path('api/', include('products.urls')),
+    path('api/metrics/requests/', RequestMetricsView.as_view(), name='request-metrics'),
+    path('api/metrics/cache/', CacheMetricsView.as_view(), name='cache-metrics'),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
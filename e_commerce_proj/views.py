@@ -0,0 +1,26 @@
+from rest_framework import generics
+from rest_framework.response import Response
+
+from products.cache import cache_stats
+from products.permissions import IsAdminOrStaff
+from .instrumentation import endpoint_stats
+
+
+class RequestMetricsView(generics.GenericAPIView):
+    """Rolling latency, query and crypto/serializer timings per endpoint."""
+    permission_classes = [IsAdminOrStaff]
+
+    def get(self, request, *args, **kwargs):
+        return Response(endpoint_stats.summary())
+
+    def delete(self, request, *args, **kwargs):
+        endpoint_stats.clear()
+        return Response(status=204)
+
+
+class CacheMetricsView(generics.GenericAPIView):
+    """Hit/miss/invalidation counters of the API read-through cache in this process."""
+    permission_classes = [IsAdminOrStaff]
+
+    def get(self, request, *args, **kwargs):
+        return Response(cache_stats())
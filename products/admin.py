@@ -1,7 +1,23 @@
 from django.contrib import admin
+from django.db import transaction
+
+from . import counters, search
 from .models import UserProfile, Product, Category
 
+
+class CollectCountsAdmin(admin.ModelAdmin):
+    """Bulk and cascading deletes adjust the product rollups in one task and the search index in one write."""
+
+    def delete_model(self, request, obj):
+        with transaction.atomic(), counters.collect(), search.collect_removals():
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic(), counters.collect(), search.collect_removals():
+            super().delete_queryset(request, queryset)
+
+
 # Register your models here.
 admin.site.register(UserProfile)
-admin.site.register(Product)
-admin.site.register(Category)
\ No newline at end of file
+admin.site.register(Product, CollectCountsAdmin)
+admin.site.register(Category, CollectCountsAdmin)
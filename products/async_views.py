@@ -0,0 +1,191 @@
+"""
+Async versions of the product and category read endpoints, for ASGI servers
+(e.g. ``uvicorn e_commerce_proj.asgi:application``). They query through the
+async ORM and decrypt on a thread pool, so a slow client or a large page no
+longer holds a worker thread. Payloads match the DRF views and share their
+API cache entries; writes stay on the DRF views.
+"""
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Q
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
+from rest_framework import exceptions
+from rest_framework.settings import api_settings
+
+from e_commerce_proj.db_routers import read_alias
+from . import cache as api_cache
+from .fields import decrypt_fields
+from .models import Category, Product
+from .permissions import IsAdminOrStaff
+from .progress import aget_progress
+from .pubsub import get_hub
+from .serializers import CategorySerializer, ProductFilterSerializer, ProductSerializer
+from .views import ProductCursorPagination, decode_cursor, encode_cursor, filter_products
+
+# Decryption is CPU-bound, so it runs off the event loop on the default executor
+decrypt_in_thread = sync_to_async(decrypt_fields, thread_sensitive=False)
+
+
+def error_response(detail, status, **kwargs):
+    return JsonResponse({'detail': detail}, status=status, **kwargs)
+
+
+def authenticate(request):
+    for authenticator_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = authenticator_class().authenticate(request)
+        if result is not None:
+            return result[0]
+    return None
+
+
+def async_read_view(permission_class):
+    """Authenticate an async GET view with the DRF authenticators and check ``permission_class``."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return HttpResponseNotAllowed(['GET', 'HEAD'])
+            try:
+                user = await sync_to_async(authenticate)(request)
+            except exceptions.APIException as exc:
+                return error_response(exc.detail, exc.status_code)
+            request.user = user or AnonymousUser()
+            if not permission_class().has_permission(request, None):
+                if user is None:
+                    challenge = api_settings.DEFAULT_AUTHENTICATION_CLASSES[0]().authenticate_header(request)
+                    return error_response(exceptions.NotAuthenticated.default_detail, 401, headers={'WWW-Authenticate': challenge})
+                return error_response(exceptions.PermissionDenied.default_detail, 403)
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def cached_response(request, namespace, build):
+    entry = await api_cache.aget_or_build(namespace, build)
+    if entry['etag'] in parse_etags(request.headers.get('If-None-Match', '')):
+        return HttpResponse(status=304, headers={'ETag': entry['etag']})
+    return JsonResponse(entry['data'], safe=False, headers={'ETag': entry['etag']})
+
+
+@async_read_view(IsAdminOrStaff)
+async def product_list(request):
+    """
+    Newest products first, paged by a keyset cursor on (created_at, id). Takes
+    the filters of the DRF list view; the order is fixed.
+    """
+    options = ProductFilterSerializer(data=request.GET)
+    if not options.is_valid():
+        return JsonResponse(options.errors, status=400)
+    queryset = filter_products(Product.objects.using(read_alias()), options.validated_data)
+    if request.GET.get('cursor'):
+        position = decode_cursor(request.GET['cursor'])
+        if position is None:
+            return error_response('Invalid cursor', 404)
+        created_at, pk = position
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    page_size = ProductCursorPagination.page_size
+    products = [product async for product in queryset.order_by('-created_at', '-id')[:page_size + 1]]
+    next_url = None
+    if len(products) > page_size:
+        products = products[:page_size]
+        query = request.GET.copy()
+        query['cursor'] = encode_cursor(products[-1])
+        next_url = request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+    await decrypt_in_thread(products, ['title', 'description'])
+    results = ProductSerializer(products, many=True, context={'request': request}).data
+    return JsonResponse({'next': next_url, 'results': results})
+
+
+@async_read_view(IsAdminOrStaff)
+async def product_detail(request, pk):
+    async def build():
+        product = await Product.objects.aget(pk=pk)
+        await decrypt_in_thread([product], ['title', 'description'])
+        return ProductSerializer(product, context={'request': request}).data
+
+    try:
+        return await cached_response(request, f'product:{pk}', build)
+    except Product.DoesNotExist:
+        return error_response('No Product matches the given query.', 404)
+
+
+@async_read_view(IsAdminOrStaff)
+async def category_list(request):
+    async def build():
+        categories = [category async for category in Category.objects.all()]
+        await decrypt_in_thread(categories, ['name'])
+        return CategorySerializer(categories, many=True, context={'request': request}).data
+
+    return await cached_response(request, 'categories', build)
+
+
+@async_read_view(IsAdminOrStaff)
+async def product_progress(request, pk):
+    progress = await aget_progress(pk)
+    if progress is None:
+        return JsonResponse({"error": "Product not found."}, status=404)
+    return JsonResponse(progress)
+
+
+def sse_event(data, event='progress'):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+@async_read_view(IsAdminOrStaff)
+async def product_events(request, pk=None):
+    """
+    Server-sent events with the video status and progress of product ``pk``, or
+    of the products in ``?ids=1,2,3``: their current state first, then every
+    change process_video publishes. Needs an ASGI server to hold many streams.
+    """
+    if pk is not None:
+        product_ids = [pk]
+    else:
+        try:
+            product_ids = sorted({int(value) for value in request.GET.get('ids', '').split(',') if value.strip()})
+        except ValueError:
+            return JsonResponse({"ids": "Expected a comma-separated list of product ids."}, status=400)
+        if not product_ids or len(product_ids) > settings.SSE_MAX_PRODUCTS:
+            return JsonResponse({"ids": f"Give between 1 and {settings.SSE_MAX_PRODUCTS} product ids."}, status=400)
+
+    hub = get_hub()
+    # Subscribe before reading the current state so no change can fall in between
+    subscription = await hub.subscribe(product_ids)
+    try:
+        current = []
+        for product_id in product_ids:
+            progress = await aget_progress(product_id)
+            if progress is not None:
+                current.append({'product_id': product_id, **progress})
+    except BaseException:
+        hub.unsubscribe(subscription)
+        raise
+    if pk is not None and not current:
+        hub.unsubscribe(subscription)
+        return JsonResponse({"error": "Product not found."}, status=404)
+
+    async def stream():
+        try:
+            for event in current:
+                yield sse_event(event)
+            while True:
+                events = await subscription.get(settings.SSE_KEEPALIVE_INTERVAL)
+                if not events:
+                    # Comment line, so proxies and load balancers keep the connection open
+                    yield ': keepalive\n\n'
+                for event in events:
+                    yield sse_event(event)
+        finally:
+            hub.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
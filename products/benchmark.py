@@ -0,0 +1,143 @@
+import asyncio
+import os
+import re
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+
+# The query count RequestMetricsMiddleware puts in Server-Timing
+QUERY_COUNT = re.compile(r'desc="(\d+) queries"')
+
+@contextmanager
+def benchmark_database():
+    """
+    Run the block against a freshly created, throwaway test database, built
+    from the models as for the test suite, with Celery tasks (such as the
+    product count updates sent on commit) run in-process instead of queued.
+    """
+    from e_commerce_proj.celery import app
+    eager = {'task_always_eager': True, 'task_eager_propagates': True}
+    previous = {name: app.conf[name] for name in eager}
+    app.conf.update(eager)
+    # No products migrations are committed
+    migrations = override_settings(MIGRATION_MODULES={'products': None})
+    migrations.enable()
+    setup_test_environment()
+    test_db = None
+    if connection.vendor == 'sqlite':
+        # A file-backed database so every client thread sees the same data
+        test_db = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False).name
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = test_db
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        migrations.disable()
+        app.conf.update(previous)
+        if test_db and os.path.exists(test_db):
+            os.remove(test_db)
+
+
+def percentile(latencies, pct):
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method='inclusive')[pct - 1]
+
+
+def drive(method, path, requests, concurrency, headers=None, data=None, client_class=Client):
+    """
+    Send ``requests`` calls to ``path`` from ``concurrency`` threads, each with
+    its own test client and database connection, and summarize the latencies
+    and queries per request.
+    """
+    latencies = []
+    queries = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        client = client_class(**(headers or {}))
+        try:
+            while True:
+                with lock:
+                    if next(counter, None) is None:
+                        return
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = getattr(client, method)(path, data)
+                    if getattr(response, 'streaming', False):
+                        for _ in response.streaming_content:
+                            pass
+                    elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed * 1000)
+                    queries.append(len(captured))
+                    if response.status_code >= 400:
+                        errors.append(response.status_code)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    return summarize(latencies, queries, errors, concurrency, wall)
+
+
+def adrive(path, requests, concurrency, headers=None):
+    """
+    drive() through the ASGI handler: GET ``path`` ``requests`` times from
+    ``concurrency`` coroutines on one event loop. Queries per request are read
+    from the Server-Timing header, as the async ORM queries on another thread.
+    """
+    async def run():
+        client = AsyncClient()
+        pending = iter(range(requests))
+        latencies, queries, errors = [], [], []
+
+        async def worker():
+            for _ in pending:
+                start = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                latencies.append((time.perf_counter() - start) * 1000)
+                match = QUERY_COUNT.search(response.get('Server-Timing', ''))
+                queries.append(int(match.group(1)) if match else 0)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+        await sync_to_async(connections.close_all)()
+        return summarize(latencies, queries, errors, concurrency, wall)
+
+    return asyncio.run(run())
+
+
+def summarize(latencies, queries, errors, concurrency, wall):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'errors': len(errors),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else 0.0,
+        'queries_per_request': round(statistics.mean(queries), 2) if queries else 0.0,
+    }
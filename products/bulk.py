@@ -0,0 +1,161 @@
+"""
+Bulk upserts and deletes of products, applied in chunked transactions.
+
+Each operation is a dict: ``{"op": "delete", "id": 7}`` or an upsert
+(``"op"`` defaults to ``"upsert"``) carrying product fields, with an ``id`` to
+update an existing product or without one to create a new product.
+"""
+from collections import defaultdict
+from functools import partial
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError, ValidationError
+
+from . import cache as api_cache
+from . import counters
+from . import search
+from .blind_index import build_tokens
+from .fields import Ciphertext
+from .models import Category, Product
+from .serializers import BulkProductSerializer
+from .utils import blind_index, get_cipher
+
+# Ids come straight from the request body, so strings, floats, lists... all turn up
+_ID_FIELD = serializers.IntegerField(min_value=1)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def apply_operations(operations, chunk_size=None, user=None):
+    """Apply ``operations`` and yield one result dict per operation, in input order."""
+    chunk_size = chunk_size or settings.PRODUCT_BULK_CHUNK_SIZE
+    context = {'category_ids': set(Category.objects.values_list('id', flat=True)), 'user_id': user.pk if user is not None else None}
+    offset = 0
+    for chunk in chunked(operations, chunk_size):
+        yield from _apply_chunk(chunk, offset, context)
+        offset += len(chunk)
+
+
+def _apply_chunk(chunk, offset, context):
+    results = [None] * len(chunk)
+    creates, updates, deletes = [], [], []
+    for position, operation in enumerate(chunk):
+        index = offset + position
+        if isinstance(operation, ParseError):
+            # A line of an NDJSON stream that is not JSON
+            results[position] = {'index': index, 'status': 'error', 'errors': {'non_field_errors': [str(operation.detail)]}}
+        elif not isinstance(operation, dict):
+            results[position] = {'index': index, 'status': 'error', 'errors': {'non_field_errors': ['Expected an object.']}}
+        elif operation.get('op', 'upsert') not in ('upsert', 'delete'):
+            results[position] = {'index': index, 'status': 'error', 'errors': {'op': ['Must be "upsert" or "delete".']}}
+        elif operation.get('op', 'upsert') == 'upsert' and operation.get('id') is None:
+            creates.append((position, operation))
+        else:
+            try:
+                pk = _ID_FIELD.run_validation(operation.get('id'))
+            except ValidationError as e:
+                results[position] = {'index': index, 'status': 'error', 'errors': {'id': e.detail}}
+                continue
+            if operation.get('op', 'upsert') == 'delete':
+                deletes.append((position, pk))
+            else:
+                updates.append((position, pk, operation))
+
+    existing = Product.objects.in_bulk([pk for _, pk, _ in updates])
+    validated = []
+
+    # Creates are validated as one many=True list; a single bad item voids the whole
+    # list's validated_data, so only then are they re-validated one by one
+    serializer = BulkProductSerializer(data=[operation for _, operation in creates], many=True, context=context)
+    if serializer.is_valid():
+        validated.extend((position, Product(), data) for (position, _), data in zip(creates, serializer.validated_data))
+    else:
+        for (position, operation), errors in zip(creates, serializer.errors):
+            item = BulkProductSerializer(data=operation, context=context)
+            if not errors and item.is_valid():
+                validated.append((position, Product(), item.validated_data))
+            else:
+                results[position] = {'index': offset + position, 'status': 'error', 'errors': errors or item.errors}
+
+    for position, pk, operation in updates:
+        instance = existing.get(pk)
+        if instance is None:
+            results[position] = {'index': offset + position, 'id': pk, 'status': 'error', 'errors': {'id': ['Not found.']}}
+            continue
+        item = BulkProductSerializer(instance, data=operation, partial=True, context=context)
+        if item.is_valid():
+            validated.append((position, instance, item.validated_data))
+        else:
+            results[position] = {'index': offset + position, 'id': instance.pk, 'status': 'error', 'errors': item.errors}
+
+    plaintexts = _encrypt(validated)
+    now = timezone.now()
+    created, updated = [], []
+    # Rows are updated in groups with the same fields: a field in the UPDATE but not in
+    # the row's data would be read back, decrypted and encrypted again for nothing
+    update_groups = defaultdict(list)
+    for position, instance, data in validated:
+        for name, value in data.items():
+            setattr(instance, 'category_id' if name == 'category' else name, value)
+        if instance.pk is None:
+            instance.created_by_id = context['user_id']
+            created.append(instance)
+            results[position] = {'index': offset + position, 'status': 'created'}
+        else:
+            instance.updated_at = now
+            update_groups[frozenset('category' if name == 'category' else name for name in data)].append(instance)
+            updated.append(instance)
+            results[position] = {'index': offset + position, 'status': 'updated'}
+
+    with transaction.atomic(), counters.collect(), search.collect_removals():
+        Product.objects.bulk_create(created)
+        for fields, instances in update_groups.items():
+            Product.objects.bulk_update(instances, sorted(fields | {'updated_at'}))
+        counters.count_created(created)
+        counters.count_changed(updated)
+        deleted_ids = set(Product.objects.filter(pk__in=[pk for _, pk in deletes]).values_list('pk', flat=True))
+        Product.objects.filter(pk__in=deleted_ids).delete()
+        # Hand the saved instances their plaintext back so indexing them needs no decrypt
+        for (_, instance, _), values in zip(validated, plaintexts):
+            instance.__dict__.update(values)
+        build_tokens([instance for _, instance, data in validated if 'title' in data])
+        transaction.on_commit(partial(search.index_products, [instance for _, instance, _ in validated]))
+
+    # bulk_update() sends no post_save, so cached detail payloads are dropped here
+    for instance in updated:
+        api_cache.invalidate(f'product:{instance.pk}')
+
+    for position, instance, _ in validated:
+        results[position]['id'] = instance.pk
+    for position, pk in deletes:
+        found = pk in deleted_ids
+        results[position] = {'index': offset + position, 'id': pk, 'status': 'deleted' if found else 'error'}
+        if not found:
+            results[position]['errors'] = {'id': ['Not found.']}
+    return results
+
+
+def _encrypt(validated):
+    """
+    Encrypt every title and description of the chunk in one batch per field,
+    set the title's blind index, and return each item's plaintext values.
+    """
+    cipher = get_cipher()
+    plaintexts = [{} for _ in validated]
+    for name in ('title', 'description'):
+        items = [(values, data) for values, (_, _, data) in zip(plaintexts, validated) if name in data]
+        ciphertexts = cipher.encrypt_many(data[name] for _, data in items)
+        for (values, data), ciphertext in zip(items, ciphertexts):
+            values[name] = data[name]
+            data[name] = Ciphertext(ciphertext)
+            if name == 'title':
+                data['title_index'] = blind_index(values[name])
+    return plaintexts
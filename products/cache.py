@@ -0,0 +1,109 @@
+"""
+Read-through cache for serialized (already decrypted) API payloads.
+
+Entries live in the 'api' cache alias, which must be shared by every process
+that writes products (web, Celery workers, management commands): keys carry a
+per-namespace version that model signals bump, so a reader racing an
+invalidation can only write under a version nobody reads any more. A process-
+local LocMemCache would never see other processes' bumps, so with one the
+cache is bypassed and every read is built fresh.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.serializers.json import DjangoJSONEncoder
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def api_cache():
+    """The 'api' cache, or None when it is local to this process."""
+    cache = caches[settings.API_CACHE_ALIAS]
+    return None if isinstance(cache, LocMemCache) else cache
+
+
+def _count(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats.get('hit', 0) + stats.get('miss', 0)
+    stats['hit_ratio'] = round(stats.get('hit', 0) / lookups, 3) if lookups else None
+    return stats
+
+
+def _version_key(namespace):
+    return f'{settings.API_CACHE_KEY_PREFIX}:version:{namespace}'
+
+
+def invalidate(namespace):
+    cache = api_cache()
+    if cache is None:
+        return
+    key = _version_key(namespace)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # No version stored yet (or it was evicted); a never-used value retires old entries
+        cache.set(key, time.time_ns(), None)
+    _count('invalidate')
+
+
+def etag_for(data):
+    body = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode()
+    return '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+def _entry_key(namespace, version):
+    return f'{settings.API_CACHE_KEY_PREFIX}:{namespace}:v{version}'
+
+
+def _build_entry(data):
+    return {'etag': etag_for(data), 'data': data}
+
+
+def get_or_build(namespace, build):
+    """Return ``{'etag', 'data'}`` for ``namespace``, calling ``build()`` on a miss."""
+    cache = api_cache()
+    if cache is None:
+        _count('bypass')
+        return _build_entry(build())
+    # Seeded from the clock so a version evicted from the LRU never comes back as an old value
+    version = cache.get_or_set(_version_key(namespace), time.time_ns, None)
+    key = _entry_key(namespace, version)
+    entry = cache.get(key)
+    if entry is not None:
+        _count('hit')
+        return entry
+    _count('miss')
+    entry = _build_entry(build())
+    cache.set(key, entry, settings.API_CACHE_TIMEOUT)
+    return entry
+
+
+async def aget_or_build(namespace, build):
+    """Async get_or_build(), for a ``build`` coroutine function. Shares entries with it."""
+    cache = api_cache()
+    if cache is None:
+        _count('bypass')
+        return _build_entry(await build())
+    version = await cache.aget_or_set(_version_key(namespace), time.time_ns, None)
+    key = _entry_key(namespace, version)
+    entry = await cache.aget(key)
+    if entry is not None:
+        _count('hit')
+        return entry
+    _count('miss')
+    entry = _build_entry(await build())
+    await cache.aset(key, entry, settings.API_CACHE_TIMEOUT)
+    return entry
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+
+@register()
+def check_encryption_key(app_configs, **kwargs):
+    # Ciphers are created on first use, so a missing key would otherwise only surface mid-request
+    if settings.ENCRYPTION_KEYS.get('default'):
+        return []
+    return [Warning(
+        'No encryption key is configured; encrypted product fields cannot be read or written.',
+        hint='Set the ENCRYPTION_KEY environment variable.',
+        id='products.W001',
+    )]
+
+
+@register()
+def check_blind_index_key(app_configs, **kwargs):
+    if settings.BLIND_INDEX_KEY or not settings.ENCRYPTION_PREVIOUS_KEYS.get('default'):
+        return []
+    return [Error(
+        'ENCRYPTION_PREVIOUS_KEYS is set but BLIND_INDEX_KEY is not; blind indexes cannot be keyed from a retiring key.',
+        hint='Before rotating ENCRYPTION_KEY, set BLIND_INDEX_KEY and run manage.py backfill_blind_index.',
+        id='products.E002',
+    )]
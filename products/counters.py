@@ -0,0 +1,177 @@
+"""
+Product rollups per (category, status): the number of products and their
+price total, minimum and maximum, so dashboards and facet sidebars read a
+handful of ProductCount rows instead of aggregating over Product.
+
+Saves and deletes turn into count/price deltas that a Celery task
+(products.tasks.adjust_product_counts) applies once their transaction
+commits; collect() folds those of a bulk operation into one task.
+``manage.py rebuild_product_counts`` recomputes every row at once.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Min, Sum
+
+from .models import Category, Product, ProductCount
+
+CENT = Decimal('0.01')
+
+
+class PendingDeltas(dict):
+    """
+    ``(category_id, status) -> [count change, price change]``, sent to
+    adjust_product_counts in a single task once the transaction commits.
+    """
+
+    def add(self, category_id, status, count, price):
+        delta = self.setdefault((category_id, status), [0, Decimal(0)])
+        delta[0] += count
+        delta[1] += count * Decimal(price)
+
+    def merge(self, other):
+        for key, (count, total) in other.items():
+            delta = self.setdefault(key, [0, Decimal(0)])
+            delta[0] += count
+            delta[1] += total
+
+    def __call__(self):
+        from .tasks import adjust_product_counts
+        rows = [[category_id, status, count, str(total)] for (category_id, status), (count, total) in self.items() if count or total]
+        if rows:
+            adjust_product_counts.delay(rows)
+
+
+_local = threading.local()
+
+
+@contextmanager
+def collect():
+    """
+    Merge the deltas of everything done in the block, such as a bulk or
+    cascading delete that sends one signal per row, into a single task queued
+    as the block ends. Nothing is queued if the block raises.
+    """
+    if getattr(_local, 'pending', None) is not None:
+        # Nested: the outer block sends them
+        yield
+        return
+    _local.pending = PendingDeltas()
+    try:
+        yield
+        pending = _local.pending
+    finally:
+        _local.pending = None
+    schedule(pending)
+
+
+def schedule(deltas):
+    """Send ``deltas`` once the current transaction commits, or with the rest of an enclosing collect() block."""
+    if not deltas:
+        return
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.merge(deltas)
+        return
+    transaction.on_commit(deltas)
+
+
+def count_created(products):
+    deltas = PendingDeltas()
+    for product in products:
+        deltas.add(product.category_id, product.status, 1, product.price)
+    schedule(deltas)
+
+
+def count_changed(products):
+    """Move the rollups of loaded ``products`` whose category, status or price was changed."""
+    deltas = PendingDeltas()
+    for product in products:
+        counted = getattr(product, '_counted', None)
+        current = (product.category_id, product.status, Decimal(product.price))
+        if counted is None or None in counted or counted == current:
+            continue
+        deltas.add(counted[0], counted[1], -1, counted[2])
+        deltas.add(current[0], current[1], 1, current[2])
+        product._counted = current
+    schedule(deltas)
+
+
+def count_deleted(products):
+    deltas = PendingDeltas()
+    for product in products:
+        deltas.add(product.category_id, product.status, -1, product.price)
+    schedule(deltas)
+
+
+def adjust(rows):
+    """Apply the ``[category_id, status, count change, price change]`` rows of a PendingDeltas."""
+    for category_id, status, count, total in rows:
+        rollup = ProductCount.objects.filter(category_id=category_id, status=status)
+        changes = {'count': F('count') + count, 'price_total': F('price_total') + Decimal(total)}
+        updated = rollup.update(**changes)
+        # Decrements never create rows: the category may be mid-delete
+        if not updated and count > 0:
+            try:
+                with transaction.atomic():
+                    ProductCount.objects.create(category_id=category_id, status=status, count=count, price_total=total)
+            except IntegrityError:
+                rollup.update(**changes)
+        # Two index seeks on (category, status, price); deltas alone cannot tell
+        # what replaces a minimum or maximum that went away
+        prices = Product.objects.filter(category_id=category_id, status=status).order_by('price').values_list('price', flat=True)
+        rollup.update(price_min=prices.first(), price_max=prices.last())
+
+
+def price_stats(rollups):
+    count = sum(rollup['count'] for rollup in rollups)
+    prices = [rollup for rollup in rollups if rollup['price_min'] is not None]
+    return {
+        'count': count,
+        'min_price': min((rollup['price_min'] for rollup in prices), default=None),
+        'max_price': max((rollup['price_max'] for rollup in prices), default=None),
+        'avg_price': (sum(rollup['price_total'] for rollup in rollups) / count).quantize(CENT) if count else None,
+    }
+
+
+def facets(category=None, status=None):
+    """
+    Count and price range of the products per status (within ``category``,
+    when given) and per category (within ``status``), ordered by status and
+    category name.
+    """
+    by_status, by_category = defaultdict(list), defaultdict(list)
+    for rollup in ProductCount.objects.filter(count__gt=0).values('category_id', 'status', 'count', 'price_total', 'price_min', 'price_max'):
+        if category is None or rollup['category_id'] == category:
+            by_status[rollup['status']].append(rollup)
+        if status is None or rollup['status'] == status:
+            by_category[rollup['category_id']].append(rollup)
+
+    categories = Category.objects.filter(pk__in=by_category).only('name')
+    return {
+        'statuses': [{'status': key, **price_stats(rollups)} for key, rollups in sorted(by_status.items())],
+        'categories': sorted(
+            ({'id': category.pk, 'name': category.name, **price_stats(by_category[category.pk])} for category in categories),
+            key=lambda facet: facet['name'],
+        ),
+    }
+
+
+def rebuild():
+    """Recompute every rollup with one GROUP BY over Product."""
+    rows = Product.objects.order_by().values('category_id', 'status').annotate(
+        total=Count('id'), price_total=Sum('price'), price_min=Min('price'), price_max=Max('price'),
+    )
+    with transaction.atomic():
+        ProductCount.objects.all().delete()
+        ProductCount.objects.bulk_create(
+            ProductCount(
+                category_id=row['category_id'], status=row['status'], count=row['total'],
+                price_total=row['price_total'], price_min=row['price_min'], price_max=row['price_max'],
+            )
+            for row in rows
+        )
+    return len(rows)
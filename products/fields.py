@@ -0,0 +1,129 @@
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+from .utils import get_cipher, decrypt_or_raw, blind_index
+
+
+class Ciphertext(str):
+    """A column value as stored in the database, not decrypted yet."""
+
+
+class DecryptedAttribute(DeferredAttribute):
+    """
+    Keep the ciphertext loaded from the database on the instance and only
+    decrypt it the first time the attribute is read. The plaintext then
+    replaces the ciphertext, so each field is decrypted at most once per
+    instance.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, Ciphertext):
+            value = instance.__dict__[self.field.attname] = self.field.decrypt(value)
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class EncryptedFieldMixin:
+    """
+    Store the field AES-encrypted while exposing plaintext on model instances.
+
+    Values are encrypted in get_prep_value and decrypted lazily on attribute
+    access. values()/values_list() return the raw ``Ciphertext``, and exact
+    lookups cannot match since every encryption uses a fresh IV.
+    """
+    descriptor_class = DecryptedAttribute
+
+    def __init__(self, *args, key_id='default', **kwargs):
+        self.key_id = key_id
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.key_id != 'default':
+            kwargs['key_id'] = self.key_id
+        return name, path, args, kwargs
+
+    @property
+    def cipher(self):
+        return get_cipher(self.key_id)
+
+    def decrypt(self, value):
+        # Rows written before the field was encrypted are passed through as-is
+        return decrypt_or_raw(self.cipher, value)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return Ciphertext(value)
+
+    def pre_save(self, model_instance, add):
+        # Save the stored ciphertext untouched if the value was never read
+        value = model_instance.__dict__.get(self.attname)
+        if isinstance(value, Ciphertext):
+            return value
+        return super().pre_save(model_instance, add)
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None or isinstance(value, Ciphertext):
+            return value
+        return self.cipher.encrypt(value)
+
+
+class EncryptedCharField(EncryptedFieldMixin, models.CharField):
+    def db_type(self, connection):
+        # The column holds the key id prefix and base64(iv + padded ciphertext) of up to 4 UTF-8 bytes per character
+        padded = (self.max_length * 4 // 16 + 1) * 16
+        encrypted_length = len('$1$12345678$') + -(-(16 + padded) // 3) * 4
+        return connection.data_types['CharField'] % {'max_length': encrypted_length}
+
+
+class EncryptedTextField(EncryptedFieldMixin, models.TextField):
+    pass
+
+
+class BlindIndexField(models.CharField):
+    """
+    Indexed HMAC digest of an encrypted field's normalized plaintext, kept in
+    step with ``source`` on save so exact-match lookups are an index seek.
+    bulk_update() bypasses pre_save, so list this field alongside its source.
+    """
+
+    def __init__(self, *args, source, **kwargs):
+        self.source = source
+        kwargs.setdefault('max_length', 32)
+        kwargs.setdefault('db_index', True)
+        kwargs.setdefault('editable', False)
+        kwargs.setdefault('default', '')
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['source'] = self.source
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = model_instance.__dict__.get(self.source)
+        if value is None or isinstance(value, Ciphertext):
+            # Source unchanged since it was loaded, so the stored digest still holds
+            return getattr(model_instance, self.attname)
+        digest = blind_index(value)
+        setattr(model_instance, self.attname, digest)
+        return digest
+
+
+def decrypt_fields(instances, field_names):
+    """Decrypt ``field_names`` across ``instances`` with one batch call per field."""
+    for name in field_names:
+        pending = [obj for obj in instances if isinstance(obj.__dict__.get(name), Ciphertext)]
+        if not pending:
+            continue
+        field = pending[0]._meta.get_field(name)
+        values = field.cipher.decrypt_many((obj.__dict__[name] for obj in pending), raw_on_error=True)
+        for obj, value in zip(pending, values):
+            obj.__dict__[name] = value
@@ -0,0 +1,196 @@
+"""
+Bulk product import from NDJSON or CSV files, for catalogue loads too large
+for the API. CSV files use the ExportProductsCSV columns (header labels or
+field names); NDJSON records use the field names. The ID, Created At and
+Updated At columns are ignored: imported rows get new ids and timestamps.
+
+Records stream through a generator pipeline (read, parse, batch). Each batch
+is encrypted on a process pool while earlier batches are written, so memory
+only holds the batches in flight. A batch is written in one transaction along
+with its ProductImport checkpoint, so an interrupted import resumes after the
+last batch it wrote.
+"""
+import csv
+import gzip
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+from functools import partial
+from itertools import islice
+
+import django
+from django.db import connections, transaction
+from django.db.models import F
+
+from . import counters
+from . import search
+from .blind_index import insert_tokens
+from .bulk import chunked
+from .fields import Ciphertext, decrypt_fields
+from .models import Category, Product, ProductImport
+from .utils import blind_index, get_cipher, normalize_for_index, prefix_tokens
+
+CENT = Decimal('0.01')
+MAX_PRICE = Decimal('99999999.99')
+
+
+def open_source(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def read_records(file, format):
+    """Yield each record of ``file``: a dict keyed by field name, or an NDJSON line parse() decodes."""
+    if format == 'ndjson':
+        yield from (line for line in file if line.strip())
+        return
+    reader = csv.reader(file)
+    # "Created At" -> created_at, so both the export's labels and field names work
+    header = [column.strip().casefold().replace(' ', '_') for column in next(reader, [])]
+    for row in reader:
+        yield dict(zip(header, row))
+
+
+def parse(record, categories):
+    """``(category_id, title, description, price, status)`` of ``record``; ValueError if invalid."""
+    if isinstance(record, str):
+        record = json.loads(record)
+    if not isinstance(record, dict):
+        raise ValueError('Expected an object.')
+    name = str(record.get('category') or '')
+    category_id = categories.get(normalize_for_index(name))
+    if category_id is None:
+        categories.missing(name)
+        category_id = categories[normalize_for_index(name)]
+
+    title = str(record.get('title') or '').strip()
+    if not title or len(title) > 255:
+        raise ValueError('title: Expected 1 to 255 characters.')
+    description = str(record.get('description') or '')
+
+    try:
+        price = Decimal(str(record.get('price', '')).strip())
+    except InvalidOperation:
+        raise ValueError('price: Not a number.')
+    if not price.is_finite() or price < 0 or price > MAX_PRICE or price != price.quantize(CENT):
+        raise ValueError('price: Expected 0 to 99999999.99 with at most 2 decimal places.')
+
+    status = str(record.get('status') or 'pending')
+    if len(status) > 50:
+        raise ValueError('status: Expected at most 50 characters.')
+    return category_id, title, description, price, status
+
+
+class CategoryMap(dict):
+    """Category ids by normalized name, loaded once; ``create`` adds missing names."""
+
+    def __init__(self, create=False):
+        categories = list(Category.objects.only('name'))
+        decrypt_fields(categories, ['name'])
+        super().__init__((normalize_for_index(category.name), category.pk) for category in categories)
+        self.create = create
+
+    def missing(self, name):
+        if not self.create or not name.strip():
+            raise ValueError(f'category: No category named "{name}".')
+        self[normalize_for_index(name)] = Category.objects.create(name=name.strip()).pk
+
+
+def encrypt_rows(rows):
+    """
+    Ciphertexts of each ``(title, description)`` with the title's blind index
+    and prefix token digests. Runs in the pool's processes.
+    """
+    cipher = get_cipher()
+    return [
+        (
+            cipher.encrypt(title),
+            cipher.encrypt(description),
+            blind_index(title),
+            [blind_index(prefix) for prefix in prefix_tokens(title)],
+        )
+        for title, description in rows
+    ]
+
+
+def write_batch(checkpoint, rows, encrypted, position, skipped, index_search):
+    products = [
+        Product(
+            category_id=category_id, title=Ciphertext(title_ct), title_index=title_index,
+            description=Ciphertext(description_ct), price=price, status=status,
+        )
+        for (category_id, _, _, price, status), (title_ct, description_ct, title_index, _) in zip(rows, encrypted)
+    ]
+    with transaction.atomic():
+        Product.objects.bulk_create(products)
+        insert_tokens(Product, [
+            (product.pk, 'title', digest) for product, (_, _, _, digests) in zip(products, encrypted) for digest in digests
+        ])
+        counters.count_created(products)
+        ProductImport.objects.filter(pk=checkpoint.pk).update(
+            position=position, imported=F('imported') + len(products), skipped=F('skipped') + skipped,
+        )
+        if index_search:
+            # Hand the plaintext back so indexing needs no decrypt
+            for product, (_, title, description, _, _) in zip(products, rows):
+                product.__dict__.update(title=title, description=description)
+            transaction.on_commit(partial(search.index_products, products))
+    return len(products)
+
+
+def import_products(path, format, source=None, batch_size=2000, processes=None, restart=False,
+                    create_categories=False, index_search=True, on_error=None, on_batch=None):
+    """
+    Import the records of ``path`` after those its checkpoint (``source``,
+    default ``path``) already covers. ``processes=0`` encrypts in this
+    process. Returns the final ProductImport.
+    """
+    checkpoint, _ = ProductImport.objects.get_or_create(source=source or path)
+    if restart:
+        checkpoint.position = checkpoint.imported = checkpoint.skipped = 0
+        checkpoint.save()
+    categories = CategoryMap(create=create_categories)
+
+    pool = None
+    if processes != 0:
+        processes = processes or os.cpu_count()
+        # Workers never query; don't hand them this process's open connections
+        connections.close_all()
+        pool = ProcessPoolExecutor(max_workers=processes, initializer=django.setup)
+    # Batches parsed but not written yet: enough to keep every worker busy
+    in_flight = deque()
+    max_in_flight = 2 * (processes or 1)
+
+    def drain(limit):
+        while len(in_flight) > limit:
+            rows, encrypted, position, skipped = in_flight.popleft()
+            write_batch(checkpoint, rows, encrypted.result() if pool else encrypted, position, skipped, index_search)
+            if on_batch:
+                checkpoint.refresh_from_db()
+                on_batch(checkpoint)
+
+    try:
+        with open_source(path) as file:
+            records = enumerate(islice(read_records(file, format), checkpoint.position, None), start=checkpoint.position + 1)
+            for batch in chunked(records, batch_size):
+                rows, skipped = [], 0
+                for number, record in batch:
+                    try:
+                        rows.append(parse(record, categories))
+                    except ValueError as exc:
+                        skipped += 1
+                        if on_error:
+                            on_error(number, str(exc))
+                plaintexts = [(title, description) for _, title, description, _, _ in rows]
+                encrypted = pool.submit(encrypt_rows, plaintexts) if pool else encrypt_rows(plaintexts)
+                in_flight.append((rows, encrypted, batch[-1][0], skipped))
+                drain(max_in_flight)
+            drain(0)
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    checkpoint.refresh_from_db()
+    return checkpoint
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products.blind_index import blind_index_fields, build_tokens
+from products.fields import decrypt_fields
+from products.models import Category, Product
+from products.utils import blind_index
+
+
+class Command(BaseCommand):
+    help = 'Compute blind index digests and prefix tokens for existing categories and products.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--model', choices=['category', 'product'], help='Only backfill one model.')
+
+    def handle(self, *args, **options):
+        models = {'category': Category, 'product': Product}
+        if options['model']:
+            models = {options['model']: models[options['model']]}
+        for label, model in models.items():
+            total = self.backfill(model, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Indexed {total} {label} rows."))
+
+    def backfill(self, model, batch_size):
+        index_fields = blind_index_fields(model)
+        sources = [field.source for field in index_fields]
+        queryset = model.objects.only('pk', *sources, *[field.name for field in index_fields]).order_by('pk')
+        last_pk = 0
+        total = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return total
+            decrypt_fields(batch, sources)
+            for instance in batch:
+                for field in index_fields:
+                    setattr(instance, field.attname, blind_index(getattr(instance, field.source) or ''))
+            with transaction.atomic():
+                model.objects.bulk_update(batch, [field.name for field in index_fields])
+                build_tokens(batch)
+            last_pk = batch[-1].pk
+            total += len(batch)
+            self.stdout.write(f"  {model.__name__}: {total} rows")
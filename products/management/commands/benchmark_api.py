@@ -0,0 +1,96 @@
+import json
+import subprocess
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from products.authentication import RoleRefreshToken
+from products.benchmark import adrive, benchmark_database, drive
+from products.models import Category, Product, UserProfile
+from products.tasks import generate_dummy_categories, generate_dummy_products
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway database and load-test the products API, printing '
+        'latency percentiles, throughput and query counts per endpoint as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients per endpoint.')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            results = self.run_benchmarks(options)
+
+        report = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote results to {options['output']}"))
+        else:
+            self.stdout.write(report)
+
+    def seed(self, options):
+        generate_dummy_categories(options['categories'])
+        generate_dummy_products(options['products'])
+        admin = UserProfile.objects.create_user('benchmark', 'benchmark@example.com', 'benchmark', role='admin')
+        return str(RoleRefreshToken.for_user(admin).access_token)
+
+    def endpoints(self):
+        product_id = Product.objects.order_by('id').values_list('id', flat=True).first()
+        return {
+            'product-list': '/api/products/',
+            'product-detail': f'/api/products/{product_id}/',
+            'category-list': '/api/categories/',
+            'product-progress': f'/api/products/{product_id}/progress/',
+            'export-products-csv': '/api/export/products/csv/',
+            'generate-products': '/api/generate-products/',
+        }
+
+    def async_endpoints(self):
+        product_id = Product.objects.order_by('id').values_list('id', flat=True).first()
+        return {
+            'product-list': '/api/async/products/',
+            'product-detail': f'/api/async/products/{product_id}/',
+            'category-list': '/api/async/categories/',
+            'product-progress': f'/api/async/products/{product_id}/progress/',
+        }
+
+    def run_benchmarks(self, options):
+        token = self.seed(options)
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        results = {
+            'commit': self.git_revision(),
+            'database': connection.vendor,
+            'categories': Category.objects.count(),
+            'products': Product.objects.count(),
+            'endpoints': {},
+        }
+        for name, path in self.endpoints().items():
+            # The export walks the whole table, so give it a tenth of the requests
+            requests = max(1, options['requests'] // 10) if name.startswith('export') else options['requests']
+            results['endpoints'][name] = drive('get', path, requests, options['concurrency'], headers=headers)
+            self.stderr.write(f"{name}: {results['endpoints'][name]}")
+
+        # The same reads through the async views and the ASGI handler, next to their WSGI numbers
+        results['asgi'] = {}
+        for name, path in self.async_endpoints().items():
+            result = adrive(path, options['requests'], options['concurrency'], headers={'Authorization': f'Bearer {token}'})
+            wsgi = results['endpoints'][name]['throughput_rps']
+            result['throughput_vs_wsgi'] = round(result['throughput_rps'] / wsgi, 2) if wsgi else None
+            results['asgi'][name] = result
+            self.stderr.write(f"asgi {name}: {result}")
+        return results
+
+    def git_revision(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
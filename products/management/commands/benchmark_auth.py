@@ -0,0 +1,76 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from products.authentication import CachedJWTAuthentication, RoleRefreshToken
+from products.benchmark import benchmark_database, drive, percentile
+from products.models import Category, Product, UserProfile
+from products.permissions import IsAdminOrStaff
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the per-request cost of authenticating API calls: a user lookup per '
+        'request (JWTAuthentication) against the role claim and cached user state '
+        '(CachedJWTAuthentication). Prints JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000, help='authenticate() calls per variant.')
+        parser.add_argument('--requests', type=int, default=500, help='API requests per variant.')
+        parser.add_argument('--concurrency', type=int, default=4)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            results = self.run_benchmarks(options)
+        self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+
+    def run_benchmarks(self, options):
+        user = UserProfile.objects.create_user('benchmark', 'benchmark@example.com', 'benchmark', role='staff')
+        category = Category.objects.create(name='Benchmark')
+        product = Product.objects.create(category=category, title='Benchmark', description='', price=1)
+        variants = {
+            'database-lookup': (JWTAuthentication, str(RefreshToken.for_user(user).access_token)),
+            'role-claim': (CachedJWTAuthentication, str(RoleRefreshToken.for_user(user).access_token)),
+        }
+
+        results = {'authenticate': {}, 'endpoint': {}}
+        for name, (authentication_class, token) in variants.items():
+            results['authenticate'][name] = self.time_authenticate(authentication_class, token, options['iterations'])
+            self.stderr.write(f"authenticate {name}: {results['authenticate'][name]}")
+        # CachedJWTAuthentication is the configured class; it still looks up users for tokens without a role claim
+        for name, (authentication_class, token) in variants.items():
+            results['endpoint'][name] = drive(
+                'get', f'/api/products/{product.id}/progress/', options['requests'], options['concurrency'],
+                headers={'HTTP_AUTHORIZATION': f'Bearer {token}'},
+            )
+            self.stderr.write(f"endpoint {name}: {results['endpoint'][name]}")
+        return results
+
+    def time_authenticate(self, authentication_class, token, iterations):
+        """Authenticate and check IsAdminOrStaff ``iterations`` times, as every API request does."""
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        authenticator = authentication_class()
+        permission = IsAdminOrStaff()
+        timings = []
+        with CaptureQueriesContext(connection) as captured:
+            for _ in range(iterations):
+                start = time.perf_counter()
+                request.user, _token = authenticator.authenticate(request)
+                permission.has_permission(request, None)
+                timings.append((time.perf_counter() - start) * 1_000_000)
+        timings.sort()
+        return {
+            'iterations': iterations,
+            'mean_us': round(statistics.mean(timings), 1),
+            'p50_us': round(percentile(timings, 50), 1),
+            'p95_us': round(percentile(timings, 95), 1),
+            'queries_per_call': round(len(captured) / iterations, 3),
+        }
@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from products.utils import AESCipher, get_cipher
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-field cost of encrypting/decrypting product fields.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fields', type=int, default=2000, help='Number of fields per run.')
+        parser.add_argument('--length', type=int, default=64, help='Plaintext length of each field.')
+
+    def handle(self, *args, **options):
+        key = settings.ENCRYPTION_KEYS['default']
+        cipher = get_cipher()
+        plaintexts = ['x' * options['length']] * options['fields']
+        ciphertexts = cipher.encrypt_many(plaintexts)
+
+        runs = [
+            # The old view pattern derived a fresh cipher (and its SHA-256 key) every time
+            ('decrypt, new cipher per field', lambda values: [AESCipher(key).decrypt(v) for v in values], ciphertexts),
+            ('decrypt, shared cipher', lambda values: [cipher.decrypt(v) for v in values], ciphertexts),
+            ('decrypt_many, shared cipher', cipher.decrypt_many, ciphertexts),
+            ('encrypt, new cipher per field', lambda values: [AESCipher(key).encrypt(v) for v in values], plaintexts),
+            ('encrypt_many, shared cipher', cipher.encrypt_many, plaintexts),
+        ]
+        for label, func, values in runs:
+            start = time.perf_counter()
+            func(values)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{label:<32} {elapsed * 1e6 / len(values):8.2f} us/field")
@@ -0,0 +1,77 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# What `celery -A e_commerce_proj worker` does before it connects to the broker
+WORKER_BOOT = (
+    "from celery.app.utils import find_app\n"
+    "app = find_app('e_commerce_proj')\n"
+    "app.loader.import_default_modules()\n"
+)
+
+# What a web process does before serving its first request
+WEB_BOOT = (
+    "from django.core.wsgi import get_wsgi_application\n"
+    "from django.urls import get_resolver\n"
+    "get_wsgi_application()\n"
+    "get_resolver().url_patterns\n"
+)
+
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure cold start: wall time of `manage.py check`, a Celery worker boot and a web '
+        'process boot, each in fresh interpreters, plus the slowest imports of each '
+        '(python -X importtime). Prints JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh processes per scenario.')
+        parser.add_argument('--top', type=int, default=10, help='Slowest top-level imports to list.')
+
+    def handle(self, *args, **options):
+        scenarios = {
+            'check': [os.path.join(settings.BASE_DIR, 'manage.py'), 'check'],
+            'worker-boot': ['-c', WORKER_BOOT],
+            'web-boot': ['-c', WEB_BOOT],
+        }
+        results = {}
+        for name, arguments in scenarios.items():
+            results[name] = self.profile([sys.executable, *arguments], options['runs'], options['top'])
+            self.stderr.write(f"{name}: {results[name]['median_ms']} ms")
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run(self, command):
+        # Inherits DJANGO_SETTINGS_MODULE and the rest of this process's environment
+        return subprocess.run(command, cwd=settings.BASE_DIR, capture_output=True, text=True, check=True)
+
+    def profile(self, command, runs, top):
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            self.run(command)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        # Top-level imports only: their cumulative time includes everything they pulled in
+        imports = []
+        for line in self.run([command[0], '-X', 'importtime', *command[1:]]).stderr.splitlines():
+            match = IMPORT_TIME.match(line)
+            if match and len(match[3]) == 1:
+                imports.append((match[4], int(match[2]) / 1000))
+        imports.sort(key=lambda item: item[1], reverse=True)
+        return {
+            'runs': runs,
+            'median_ms': round(statistics.median(timings), 1),
+            'min_ms': round(min(timings), 1),
+            'import_ms': round(sum(ms for _, ms in imports), 1),
+            'slowest_imports': {module: round(ms, 1) for module, ms in imports[:top]},
+        }
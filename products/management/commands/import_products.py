@@ -0,0 +1,51 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import import_products
+
+
+class Command(BaseCommand):
+    help = (
+        'Import products from an NDJSON or CSV file (the product export columns; .gz files '
+        'are decompressed). Resumes after the last batch a previous run wrote.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Default: from the file extension.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Products written per transaction.')
+        parser.add_argument('--processes', type=int, help='Encryption processes (default: one per CPU; 0 encrypts in this process).')
+        parser.add_argument('--source', help='Checkpoint name (default: the absolute path).')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start from the first record.')
+        parser.add_argument('--create-categories', action='store_true', help='Create categories missing by name instead of skipping their products.')
+        parser.add_argument(
+            '--skip-search-index', action='store_true',
+            help='Leave the search index alone; run rebuild_search_index afterwards (faster for very large loads).',
+        )
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['path'])
+        if not os.path.isfile(path):
+            raise CommandError(f'No such file: {path}')
+        format = options['format'] or ('ndjson' if path.removesuffix('.gz').endswith(('.ndjson', '.jsonl')) else 'csv')
+
+        started = time.perf_counter()
+
+        def on_batch(checkpoint):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"  {checkpoint.position} records read, {checkpoint.imported} imported, {checkpoint.skipped} skipped ({elapsed:.0f}s)")
+
+        def on_error(number, message):
+            self.stderr.write(f"Record {number}: {message}")
+
+        checkpoint = import_products(
+            path, format, source=options['source'], batch_size=options['batch_size'],
+            processes=options['processes'], restart=options['restart'],
+            create_categories=options['create_categories'], index_search=not options['skip_search_index'],
+            on_error=on_error, on_batch=on_batch,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {checkpoint.imported} products ({checkpoint.skipped} skipped) from {checkpoint.position} records."
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from products import counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-category and per-status product counts and price ranges (admin dashboard, /api/products/facets/) in one pass.'
+
+    def handle(self, *args, **options):
+        rows = counters.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} product rollup rows."))
@@ -0,0 +1,34 @@
+from itertools import chain
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from products.models import Product
+from products.search import search_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the full-text search index from the products table. Searches keep '
+        'answering from the old index until the new one is swapped in.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        started = timezone.now()
+        queryset = Product.objects.only('pk', 'category', 'title', 'description', 'status', 'price', 'updated_at').order_by('pk')
+        batches = chain(
+            self.batches(queryset, options['batch_size']),
+            # Products saved while the rebuild ran may have been read before the change
+            self.batches(queryset.filter(updated_at__gte=started), options['batch_size']),
+        )
+        total = search_index().rebuild(batches, on_progress=lambda done: self.stdout.write(f"  {done} products"))
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} products for search."))
+
+    def batches(self, queryset, batch_size):
+        last_pk = 0
+        while batch := list(queryset.filter(pk__gt=last_pk)[:batch_size]):
+            yield batch
+            last_pk = batch[-1].pk
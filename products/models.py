@@ -2,8 +2,14 @@ from django.db import models
 
 # Create your models here.
 
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+import os
+import uuid
+from .fields import EncryptedCharField, EncryptedTextField, BlindIndexField
+from .blind_index import BlindIndexQuerySet, BlindIndexToken
+from .storage import video_storage
 
 # Create your models here.
 class UserProfile(AbstractUser):
@@ -15,22 +21,130 @@ class UserProfile(AbstractUser):
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='agent')
 
 class Category(models.Model):
-    name = models.CharField(max_length=255)
+    name = EncryptedCharField(max_length=255)
+    name_index = BlindIndexField(source='name')
+
+    objects = BlindIndexQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
-    title = models.CharField(max_length=255)
-    description = models.TextField()
+    title = EncryptedCharField(max_length=255)
+    title_index = BlindIndexField(source='title')
+    description = EncryptedTextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=50, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    video = models.FileField(upload_to='videos/', null=True, blank=True)
+    video = models.FileField(upload_to='videos/', storage=video_storage, null=True, blank=True)
     video_status = models.CharField(max_length=50, default='pending')
     video_progress = models.IntegerField(default=0)
+    video_poster = models.FileField(upload_to='videos/posters/', storage=video_storage, null=True, blank=True, editable=False)
+    video_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        related_name='products'
+    )
+
+    objects = BlindIndexQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='product_created_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='product_status_created_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='product_category_created_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            # Price range seeks of products.counters
+            models.Index(fields=['category', 'status', 'price'], name='product_cat_status_price_idx'),
+            models.Index(fields=['created_by', 'status', '-created_at', '-id'], name='product_owner_status_idx'),
+        ]
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the rollups were built from, to move them when these change
+        instance._counted = (instance.__dict__.get('category_id'), instance.__dict__.get('status'), instance.__dict__.get('price'))
+        return instance
+
+
+class ProductCount(models.Model):
+    """Number of products and their prices per category and status, kept current by products.counters."""
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='product_counts')
+    status = models.CharField(max_length=50)
+    count = models.BigIntegerField(default=0)
+    price_total = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    price_min = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    price_max = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+
+    class Meta:
+        unique_together = ('category', 'status')
+
+
+class ProductImport(models.Model):
+    """Checkpoint of a ``manage.py import_products`` run, saved with each batch it writes."""
+    source = models.CharField(max_length=500, unique=True)
+    # Records of the source file consumed so far, imported or skipped
+    position = models.BigIntegerField(default=0)
+    imported = models.BigIntegerField(default=0)
+    skipped = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ProductGeneration(models.Model):
+    """Progress of a generate-products job, by task id; its chunks may run on several workers."""
+    job_id = models.CharField(max_length=255, primary_key=True)
+    status = models.CharField(max_length=20, default='queued')
+    total = models.BigIntegerField()
+    done = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class KeyRotationRange(models.Model):
+    """An id range of one model that products.rotation re-encrypts under ``key_id``."""
+    model = models.CharField(max_length=100)
+    key_id = models.CharField(max_length=16)
+    start_id = models.BigIntegerField()
+    # Exclusive
+    end_id = models.BigIntegerField()
+    # Every id up to and including this one is done
+    position = models.BigIntegerField()
+    rewritten = models.BigIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('model', 'key_id', 'start_id')
+
+
+class VideoUploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='video_uploads')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def partial_path(self):
+        # Chunks are appended on local disk; completing the upload moves the file into the video storage
+        return os.path.join(settings.VIDEO_UPLOAD_PATH, f'{self.id}.part')
+
+
+class CategoryToken(BlindIndexToken):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='blind_tokens')
+
+    class Meta(BlindIndexToken.Meta):
+        unique_together = ('category', 'field', 'digest')
+
+
+class ProductToken(BlindIndexToken):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='blind_tokens')
+
+    class Meta(BlindIndexToken.Meta):
+        unique_together = ('product', 'field', 'digest')
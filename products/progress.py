@@ -0,0 +1,110 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Product, ProductGeneration
+from . import cache as api_cache
+
+# Sent with product_id, status and progress whenever a video changes state
+video_progress_changed = Signal()
+
+
+def progress_key(product_id):
+    return f'video-progress:{product_id}'
+
+
+def publish_progress(product_id, status, progress):
+    payload = {'video_status': status, 'video_progress': progress}
+    cache.set(progress_key(product_id), payload, settings.VIDEO_PROGRESS_CACHE_TTL)
+    video_progress_changed.send(sender=Product, product_id=product_id, **payload)
+
+
+def get_progress(product_id):
+    """Current video state of a product, from the cache when a worker has published it."""
+    payload = cache.get(progress_key(product_id))
+    if payload is None:
+        payload = Product.objects.filter(pk=product_id).values('video_status', 'video_progress').first()
+        if payload is not None:
+            cache.set(progress_key(product_id), payload, settings.VIDEO_PROGRESS_INTERVAL)
+    return payload
+
+
+async def aget_progress(product_id):
+    payload = await cache.aget(progress_key(product_id))
+    if payload is None:
+        payload = await Product.objects.filter(pk=product_id).values('video_status', 'video_progress').afirst()
+        if payload is not None:
+            await cache.aset(progress_key(product_id), payload, settings.VIDEO_PROGRESS_INTERVAL)
+    return payload
+
+
+class ProgressReporter:
+    """
+    Publishes every progress change but only writes video_progress to the
+    database once per VIDEO_PROGRESS_INTERVAL, with a narrow UPDATE that
+    does not fire model signals.
+    """
+
+    def __init__(self, product_id, status='processing'):
+        self.product_id = product_id
+        self.status = status
+        self.progress = 0
+        self.last_write = 0.0
+
+    def update(self, progress):
+        if progress == self.progress:
+            return
+        self.progress = progress
+        publish_progress(self.product_id, self.status, progress)
+        now = time.monotonic()
+        if now - self.last_write >= settings.VIDEO_PROGRESS_INTERVAL:
+            Product.objects.filter(pk=self.product_id).update(video_progress=progress)
+            api_cache.invalidate(f'product:{self.product_id}')
+            self.last_write = now
+
+    def finish(self, status, progress=None):
+        self.status = status
+        if progress is not None:
+            self.progress = progress
+        Product.objects.filter(pk=self.product_id).update(video_status=status, video_progress=self.progress)
+        # QuerySet.update() skips model signals, so drop the cached detail payload here
+        api_cache.invalidate(f'product:{self.product_id}')
+        publish_progress(self.product_id, status, self.progress)
+
+
+def queue_generation(job_id, total):
+    """Record a just-queued generation job, unless its task has already started reporting."""
+    ProductGeneration.objects.get_or_create(job_id=job_id, defaults={'total': total})
+
+
+def get_generation_progress(job_id):
+    """Status, products inserted and total of a dummy product generation job, or None if unknown."""
+    return ProductGeneration.objects.filter(pk=job_id).values('status', 'done', 'total').first()
+
+
+class GenerationReporter:
+    """
+    Records the progress of a dummy product generation job in its
+    ProductGeneration row. The chunks of a multi-worker job each add their
+    inserts to the row with an F() update, one per batch.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.reported = 0
+
+    def set_status(self, status, total=None):
+        if total is None:
+            # Chunks and the chord's callback do not know the job's total
+            ProductGeneration.objects.filter(pk=self.job_id).update(status=status, updated_at=timezone.now())
+        else:
+            ProductGeneration.objects.update_or_create(job_id=self.job_id, defaults={'status': status, 'total': total})
+
+    def update(self, done, total):
+        """Count the products inserted since the last call; ``done`` is this reporter's running total."""
+        delta, self.reported = done - self.reported, done
+        ProductGeneration.objects.filter(pk=self.job_id).update(done=F('done') + delta, updated_at=timezone.now())
@@ -0,0 +1,171 @@
+"""
+Pub/sub channel for video progress events, read by the SSE streams.
+
+Workers publish through publish(); each web process keeps a single
+subscription per event loop (ProgressHub) and fans the events out to its
+streams, so watchers cost no broker connections or database reads. Redis
+carries events between processes. Without PUBSUB_BROKER_URL the in-process
+LocalBroker stands in, which only reaches streams served by the publishing
+process (tests, eager Celery).
+"""
+import asyncio
+import json
+import threading
+import weakref
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+class LocalBroker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listeners = set()
+
+    def publish(self, message):
+        with self.lock:
+            listeners = list(self.listeners)
+        for loop, queue in listeners:
+            # Publishers are usually sync code on another thread than the listening loop
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    async def listen(self, subscribed):
+        listener = (asyncio.get_running_loop(), asyncio.Queue())
+        with self.lock:
+            self.listeners.add(listener)
+        subscribed.set()
+        try:
+            while True:
+                yield await listener[1].get()
+        finally:
+            with self.lock:
+                self.listeners.discard(listener)
+
+
+class RedisBroker:
+    def __init__(self, url, channel):
+        self.url = url
+        self.channel = channel
+        self._client = None
+
+    def publish(self, message):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(self.channel, json.dumps(message))
+
+    async def listen(self, subscribed):
+        import redis.asyncio
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.channel)
+        subscribed.set()
+        try:
+            async for message in pubsub.listen():
+                yield json.loads(message['data'])
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        if settings.PUBSUB_BROKER_URL:
+            _broker = RedisBroker(settings.PUBSUB_BROKER_URL, settings.PUBSUB_CHANNEL)
+        else:
+            _broker = LocalBroker()
+    return _broker
+
+
+def publish(message):
+    get_broker().publish(message)
+
+
+class Subscription:
+    """
+    The latest event for each watched product that the stream has not sent
+    yet. Progress is state, so a slow client skips stale values instead of
+    queueing them.
+    """
+
+    def __init__(self, product_ids):
+        self.product_ids = set(product_ids)
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def deliver(self, message):
+        if message['product_id'] in self.product_ids:
+            self.pending[message['product_id']] = message
+            self.ready.set()
+
+    async def get(self, timeout):
+        """Events received since the last call, or [] after ``timeout`` seconds."""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.ready.clear()
+        events, self.pending = list(self.pending.values()), {}
+        return events
+
+
+class ProgressHub:
+    """One broker subscription per event loop, shared by every stream on it."""
+
+    def __init__(self):
+        self.subscriptions = set()
+        self.task = None
+        self.subscribed = None
+
+    async def run(self, subscribed):
+        try:
+            async for message in get_broker().listen(subscribed):
+                for subscription in list(self.subscriptions):
+                    subscription.deliver(message)
+        finally:
+            # Wake streams still waiting on a broker that could not subscribe
+            subscribed.set()
+
+    async def subscribe(self, product_ids):
+        """Watch ``product_ids``; returns once events published from now on will be delivered."""
+        subscription = Subscription(product_ids)
+        self.subscriptions.add(subscription)
+        try:
+            if self.task is None or self.task.done():
+                self.subscribed = asyncio.Event()
+                self.task = asyncio.get_running_loop().create_task(self.run(self.subscribed))
+            await self.subscribed.wait()
+            if self.task.done():
+                self.task.result()
+        except BaseException:
+            self.unsubscribe(subscription)
+            raise
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+        if not self.subscriptions and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_hub():
+    loop = asyncio.get_running_loop()
+    if loop not in _hubs:
+        _hubs[loop] = ProgressHub()
+    return _hubs[loop]
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    global _broker
+    if setting in ('PUBSUB_BROKER_URL', 'PUBSUB_CHANNEL'):
+        _broker = None
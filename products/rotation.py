@@ -0,0 +1,121 @@
+"""
+Re-encryption of stored fields after ENCRYPTION_KEY is rotated (the old key
+moved to ENCRYPTION_PREVIOUS_KEYS).
+
+Each model's ids are split into KeyRotationRange rows, which Celery tasks
+(products.tasks.reencrypt_range) work through in parallel. A range is
+rewritten in short transactions of ENCRYPTION_ROTATION_BATCH_SIZE rows that
+also save its position, so an interrupted rotation resumes where it stopped.
+The KeyRing reads both keys, so reads carry on throughout; a transaction only
+locks the rows it rewrites.
+"""
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import F, Max, Q
+
+from .fields import Ciphertext, EncryptedFieldMixin
+from .models import Category, KeyRotationRange, Product
+from .utils import ciphertext_key_id, decrypt_or_raw, get_cipher
+
+ROTATED_MODELS = (Category, Product)
+
+
+def encrypted_fields(model):
+    return [field for field in model._meta.concrete_fields if isinstance(field, EncryptedFieldMixin)]
+
+
+def stale(fields):
+    """Rows with any of ``fields`` not under its current key."""
+    return ~Q(**{f'{field.name}__startswith': Ciphertext(field.cipher.prefix) for field in fields})
+
+
+def plan(chunk_size=None):
+    """Add ranges covering every existing row and return those not completed yet."""
+    if not settings.BLIND_INDEX_KEY:
+        # Without it blind indexes are keyed from the encryption key, which the rotation retires
+        raise ImproperlyConfigured('Set BLIND_INDEX_KEY and run backfill_blind_index before rotating ENCRYPTION_KEY.')
+    chunk_size = chunk_size or settings.ENCRYPTION_ROTATION_CHUNK_SIZE
+    key_id = get_cipher().key_id
+    for model in ROTATED_MODELS:
+        # Rows added from here on are written with the current key
+        last_id = model.objects.aggregate(last_id=Max('pk'))['last_id'] or 0
+        label = model._meta.label_lower
+        for start_id in range(1, last_id + 1, chunk_size):
+            KeyRotationRange.objects.get_or_create(
+                model=label, key_id=key_id, start_id=start_id,
+                defaults={'end_id': start_id + chunk_size, 'position': start_id - 1},
+            )
+    return list(KeyRotationRange.objects.filter(key_id=key_id, completed=False).order_by('model', 'start_id'))
+
+
+def start(chunk_size=None, batch_size=None):
+    """Plan the rotation and queue one task per unfinished range."""
+    from .tasks import reencrypt_range
+    ranges = plan(chunk_size)
+    for rotation_range in ranges:
+        reencrypt_range.delay(rotation_range.pk, batch_size)
+    return ranges
+
+
+def plaintext(cipher, value):
+    if ciphertext_key_id(value) is None:
+        # The oldest key's ciphertext, or plaintext written outside the API, which now gets
+        # encrypted: a plain str, since a Ciphertext would be saved as it is
+        return str(decrypt_or_raw(cipher, value))
+    # Raises for keys no longer configured rather than rewriting what cannot be read
+    return cipher.decrypt(value)
+
+
+def reencrypt(rotation_range, batch_size=None):
+    """Rewrite the stale rows of ``rotation_range`` after its position; returns how many were rewritten."""
+    batch_size = batch_size or settings.ENCRYPTION_ROTATION_BATCH_SIZE
+    model = apps.get_model(rotation_range.model)
+    fields = encrypted_fields(model)
+    queryset = model.objects.filter(stale(fields), pk__lt=rotation_range.end_id).only('pk', *[field.name for field in fields]).order_by('pk')
+    position = rotation_range.position
+    rewritten = 0
+    while True:
+        with transaction.atomic():
+            batch = list(queryset.select_for_update().filter(pk__gt=position)[:batch_size])
+            # Rows grouped by the fields they need rewritten; bulk_update would decrypt and
+            # encrypt again any other field it was given
+            rewrite = defaultdict(list)
+            for instance in batch:
+                names = []
+                for field in fields:
+                    value = instance.__dict__[field.attname]
+                    if value is not None and not value.startswith(field.cipher.prefix):
+                        # Plaintext in the instance: bulk_update encrypts it with the current key
+                        instance.__dict__[field.attname] = plaintext(field.cipher, value)
+                        names.append(field.name)
+                if names:
+                    rewrite[tuple(names)].append(instance)
+            for names, instances in rewrite.items():
+                model.objects.bulk_update(instances, names)
+            count = sum(len(instances) for instances in rewrite.values())
+            position = batch[-1].pk if batch else rotation_range.end_id - 1
+            KeyRotationRange.objects.filter(pk=rotation_range.pk).update(
+                position=position, rewritten=F('rewritten') + count, completed=not batch,
+            )
+        rewritten += count
+        if not batch:
+            return rewritten
+
+
+def status():
+    """Per model: ranges done out of planned, rows rewritten, and rows still not under the current key."""
+    key_id = get_cipher().key_id
+    report = {'key_id': key_id, 'models': {}}
+    for model in ROTATED_MODELS:
+        ranges = KeyRotationRange.objects.filter(model=model._meta.label_lower, key_id=key_id)
+        report['models'][model._meta.label_lower] = {
+            'ranges': ranges.count(),
+            'completed': ranges.filter(completed=True).count(),
+            'rewritten': sum(ranges.values_list('rewritten', flat=True)),
+            'remaining': model.objects.filter(stale(encrypted_fields(model))).count(),
+        }
+    return report
@@ -0,0 +1,235 @@
+"""
+Full-text product search.
+
+Titles and descriptions are stored encrypted, so their words are indexed in a
+separate SQLite FTS5 file (SEARCH_INDEX_PATH), together with the category,
+status and price that searches filter on. That file holds product text in the
+clear: keep it on the same protected disk as the database. Saves update it once
+their transaction commits, and ``manage.py rebuild_search_index`` rebuilds it
+from the database. collect_removals() folds the deletes of a bulk or cascading
+delete into one index write.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import partial
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+from .fields import decrypt_fields
+
+logger = logging.getLogger(__name__)
+
+TABLES = """
+CREATE TABLE IF NOT EXISTS {product} (
+    id INTEGER PRIMARY KEY,
+    category_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    price_cents INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS {text} USING fts5(
+    title, description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+"""
+
+# Product fields copied into the index
+INDEXED_FIELDS = {'title', 'description', 'category', 'status', 'price'}
+
+# bm25 weights of the title and description columns
+RANK = 'bm25(product_text, 4.0, 1.0)'
+
+
+def match_expression(text):
+    """Every word of ``text``, each matching as a prefix; quoted so no FTS5 syntax gets through."""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text.casefold()))
+
+
+def cents(price):
+    return int(Decimal(price) * 100)
+
+
+class SearchIndex:
+    def __init__(self, path):
+        self.path = str(path)
+        self.local = threading.local()
+
+    def connect(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # Autocommit; writes take the lock up front in transaction()
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(TABLES.format(product='product', text='product_text'))
+            self.local.connection = connection
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _write(self, connection, products, product_table='product', text_table='product_text'):
+        ids = [(product.pk,) for product in products]
+        connection.executemany(f'DELETE FROM {text_table} WHERE rowid = ?', ids)
+        connection.executemany(
+            f'INSERT INTO {text_table} (rowid, title, description) VALUES (?, ?, ?)',
+            [(product.pk, product.title or '', product.description or '') for product in products]
+        )
+        connection.executemany(
+            f'INSERT OR REPLACE INTO {product_table} (id, category_id, status, price_cents) VALUES (?, ?, ?, ?)',
+            [(product.pk, product.category_id, product.status, cents(product.price)) for product in products]
+        )
+
+    def index(self, products):
+        """Add or replace ``products`` (saved Product instances)."""
+        if products:
+            # Decrypted before taking the index's write lock
+            decrypt_fields(products, ['title', 'description'])
+            with self.transaction() as connection:
+                self._write(connection, products)
+
+    def remove(self, ids):
+        ids = [(pk,) for pk in ids]
+        with self.transaction() as connection:
+            connection.executemany('DELETE FROM product_text WHERE rowid = ?', ids)
+            connection.executemany('DELETE FROM product WHERE id = ?', ids)
+            if connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'product_removed'").fetchone():
+                # A rebuild is running and may have read these products before they were deleted
+                connection.executemany('INSERT OR IGNORE INTO product_removed (id) VALUES (?)', ids)
+
+    def search(self, text, category=None, status=None, min_price=None, max_price=None, limit=20, offset=0):
+        """``(product_id, score)`` pairs of the best matches, best first; lower scores rank higher."""
+        expression = match_expression(text)
+        if not expression:
+            return []
+        sql = [f'SELECT product_text.rowid, {RANK} FROM product_text JOIN product ON product.id = product_text.rowid WHERE product_text MATCH ?']
+        params = [expression]
+        if category is not None:
+            sql.append('AND product.category_id = ?')
+            params.append(category)
+        if status is not None:
+            sql.append('AND product.status = ?')
+            params.append(status)
+        if min_price is not None:
+            sql.append('AND product.price_cents >= ?')
+            params.append(cents(min_price))
+        if max_price is not None:
+            sql.append('AND product.price_cents <= ?')
+            params.append(cents(max_price))
+        sql.append(f'ORDER BY {RANK}, product_text.rowid DESC LIMIT ? OFFSET ?')
+        params += [limit, offset]
+        return self.connect().execute(' '.join(sql), params).fetchall()
+
+    def rebuild(self, batches, on_progress=None):
+        """
+        Index ``batches`` of products into new tables and swap them in at once.
+        Searches keep reading the old tables until the swap. Products removed
+        meanwhile are logged in product_removed and taken out of the new
+        tables as they are swapped in, under the same write lock as remove().
+        """
+        self.connect().executescript(
+            'DROP TABLE IF EXISTS product_new; DROP TABLE IF EXISTS product_text_new; DROP TABLE IF EXISTS product_removed;'
+            + TABLES.format(product='product_new', text='product_text_new')
+            + 'CREATE TABLE product_removed (id INTEGER PRIMARY KEY);'
+        )
+        total = 0
+        for batch in batches:
+            decrypt_fields(batch, ['title', 'description'])
+            with self.transaction() as connection:
+                self._write(connection, batch, 'product_new', 'product_text_new')
+            total += len(batch)
+            if on_progress:
+                on_progress(total)
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM product_text_new WHERE rowid IN (SELECT id FROM product_removed)')
+            connection.execute('DELETE FROM product_new WHERE id IN (SELECT id FROM product_removed)')
+            connection.execute('DROP TABLE product_removed')
+            connection.execute('DROP TABLE product')
+            connection.execute('DROP TABLE product_text')
+            connection.execute('ALTER TABLE product_new RENAME TO product')
+            connection.execute('ALTER TABLE product_text_new RENAME TO product_text')
+        # Merge the index segments the batches left behind
+        self.connect().execute("INSERT INTO product_text (product_text) VALUES ('optimize')")
+        return total
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def search_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SearchIndex(settings.SEARCH_INDEX_PATH)
+        return _index
+
+
+def index_products(products):
+    try:
+        search_index().index(products)
+    except sqlite3.Error:
+        # The database write stands; a rebuild brings the index back in step
+        logger.exception('Could not index %d products for search.', len(products))
+
+
+def remove_products(ids):
+    try:
+        search_index().remove(ids)
+    except sqlite3.Error:
+        logger.exception('Could not remove %d products from the search index.', len(ids))
+
+
+_local = threading.local()
+
+
+@contextmanager
+def collect_removals():
+    """
+    Remove the products deleted in the block, such as by a cascading delete
+    that sends one signal per row, in a single index write once the
+    transaction commits. Nothing is removed if the block raises.
+    """
+    if getattr(_local, 'removed', None) is not None:
+        # Nested: the outer block removes them
+        yield
+        return
+    _local.removed = []
+    try:
+        yield
+        removed = _local.removed
+    finally:
+        _local.removed = None
+    if removed:
+        transaction.on_commit(partial(remove_products, removed))
+
+
+def schedule_removal(ids):
+    """Remove ``ids`` once the current transaction commits, or with the rest of an enclosing collect_removals() block."""
+    removed = getattr(_local, 'removed', None)
+    if removed is not None:
+        removed.extend(ids)
+        return
+    transaction.on_commit(partial(remove_products, ids))
+
+
+@receiver(setting_changed)
+def reset_search_index(setting, **kwargs):
+    global _index
+    if setting == 'SEARCH_INDEX_PATH':
+        _index = None
@@ -1,34 +1,138 @@
 from rest_framework import serializers
-from .models import Product, Category
-from .tasks import process_video
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from django.conf import settings
+from .models import Product, Category, VideoUploadSession, UserProfile
+from .authentication import RoleRefreshToken
+from e_commerce_proj.instrumentation import timed
 
-class CategorySerializer(serializers.ModelSerializer):
+class TimedSerializerMixin:
+    """Count time spent building representations towards the request's serializer timing."""
+    @timed('serialize')
+    def to_representation(self, instance):
+        return super().to_representation(instance)
+
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = '__all__'
+        exclude = ['name_index']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = '__all__'
-
-    def create(self, validated_data):
-        product = super().create(validated_data)
-        
-        # Enqueue the video processing task if a video is uploaded
-        if product.video:
-            process_video.delay(product_id=product.id, video_file_path=product.video.path)
-        
-        return product
+        exclude = ['title_index']
 
     def update(self, instance, validated_data):
-        product = super().update(instance, validated_data)
-        
-         # Enqueue the video processing task if a new video is uploaded
-        if 'video' in validated_data and validated_data['video']:
-            process_video.delay(product_id=product.id, video_file_path=product.video.path)
-        
-        return product
+        # A new video starts over; trigger_video_processing enqueues it once saved
+        if validated_data.get('video'):
+            validated_data['video_status'] = 'pending'
+            validated_data['video_progress'] = 0
+        return super().update(instance, validated_data)
+
+class PreloadedCategoryField(serializers.PrimaryKeyRelatedField):
+    """Check category ids against context['category_ids'] instead of one query per item."""
+    def to_internal_value(self, data):
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in self.context['category_ids']:
+            self.fail('does_not_exist', pk_value=data)
+        return pk
+
+class BulkProductSerializer(ProductSerializer):
+    category = PreloadedCategoryField(queryset=Category.objects.all())
+
+    class Meta(ProductSerializer.Meta):
+        exclude = None
+        fields = ['id', 'category', 'title', 'description', 'price', 'status']
+
+class VideoUploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = VideoUploadSession
+        fields = ['id', 'product', 'filename', 'size', 'received', 'completed', 'created_at']
+        read_only_fields = ['product', 'received', 'completed']
+
+    def validate_size(self, value):
+        # Refuse oversized videos from the declared length, before any bytes are sent
+        if value > settings.VIDEO_MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(f"Video exceeds the {settings.VIDEO_MAX_UPLOAD_SIZE} byte limit.")
+        if value < 1:
+            raise serializers.ValidationError("Video is empty.")
+        return value
 
 class GenerateProductsSerializer(serializers.Serializer):
-    num_products = serializers.IntegerField()
+    num_products = serializers.IntegerField(min_value=1)
+    batch_size = serializers.IntegerField(min_value=1, required=False)
+    workers = serializers.IntegerField(min_value=1, max_value=64, default=1)
+
+class ProductFilterSerializer(serializers.Serializer):
+    status = serializers.CharField(required=False)
+    category = serializers.IntegerField(required=False)
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+
+
+class ProductFacetFilterSerializer(serializers.Serializer):
+    status = serializers.CharField(required=False)
+    category = serializers.IntegerField(required=False)
+
+
+class PriceStatsSerializer(serializers.Serializer):
+    count = serializers.IntegerField()
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True)
+    avg_price = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True)
+
+
+class StatusFacetSerializer(PriceStatsSerializer):
+    status = serializers.CharField()
+
+
+class CategoryFacetSerializer(PriceStatsSerializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+
+
+class ProductFacetsSerializer(serializers.Serializer):
+    statuses = StatusFacetSerializer(many=True)
+    categories = CategoryFacetSerializer(many=True)
+
+
+class ProductSearchSerializer(ProductFilterSerializer):
+    q = serializers.CharField(max_length=200)
+    limit = serializers.IntegerField(min_value=1, max_value=settings.SEARCH_MAX_LIMIT, default=20)
+    offset = serializers.IntegerField(min_value=0, max_value=settings.SEARCH_MAX_OFFSET, default=0)
+
+class ProductExportSerializer(ProductFilterSerializer):
+    columns = serializers.CharField(required=False)
+    compress = serializers.ChoiceField(choices=['gzip'], required=False)
+
+    def validate_columns(self, value):
+        return [column.strip() for column in value.split(',') if column.strip()]
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = RoleRefreshToken
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = RoleRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        # Re-read the role, so a role change reaches the next access token
+        role = UserProfile.objects.filter(
+            pk=refresh[jwt_settings.USER_ID_CLAIM], is_active=True
+        ).values_list('role', flat=True).first()
+        if role is None:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        refresh['role'] = role
+
+        data = {'access': str(refresh.access_token)}
+        if jwt_settings.ROTATE_REFRESH_TOKENS:
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+        return data
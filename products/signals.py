@@ -1,9 +1,66 @@
-from django.db.models.signals import post_save
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Product
-from .tasks import process_video
+from .models import Product, Category, UserProfile
+from . import cache as api_cache
+from . import counters
+from . import pubsub
+from . import search
+from .progress import publish_progress, video_progress_changed
+from .authentication import forget_user_state
 
 @receiver(post_save, sender=Product)
-def trigger_video_processing(sender, instance, **kwargs):
+def trigger_video_processing(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Narrow writes (e.g. progress updates) never carry a new video
+    if raw or (update_fields is not None and 'video' not in update_fields):
+        return
     if instance.video and instance.video_status == 'pending':
-        process_video.delay(product_id=instance.id, video_file_path=instance.video.path)
\ No newline at end of file
+        from .tasks import process_video
+
+        def enqueue():
+            # Replace the previous upload's cached state, which may still read 'completed'
+            publish_progress(instance.id, 'pending', 0)
+            process_video.delay(product_id=instance.id, video_name=instance.video.name)
+        transaction.on_commit(enqueue)
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_cache(sender, instance, **kwargs):
+    api_cache.invalidate('categories')
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    api_cache.invalidate(f'product:{instance.pk}')
+
+@receiver(post_save, sender=Product)
+def update_product_counts(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.count_created([instance])
+        instance._counted = (instance.category_id, instance.status, Decimal(instance.price))
+    elif update_fields is None or {'status', 'category', 'price'} & set(update_fields):
+        counters.count_changed([instance])
+
+@receiver(post_delete, sender=Product)
+def remove_product_counts(sender, instance, **kwargs):
+    counters.count_deleted([instance])
+
+@receiver(video_progress_changed)
+def broadcast_video_progress(sender, product_id, video_status, video_progress, **kwargs):
+    pubsub.publish({'product_id': product_id, 'video_status': video_status, 'video_progress': video_progress})
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def forget_cached_user_state(sender, instance, **kwargs):
+    forget_user_state(instance.pk)
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not search.INDEXED_FIELDS & set(update_fields)):
+        return
+    transaction.on_commit(lambda: search.index_products([instance]))
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.schedule_removal([instance.pk])
@@ -0,0 +1,223 @@
+"""
+Storage of product videos, their renditions and posters: the ``videos``
+entry of STORAGES.
+
+LocalVideoStorage keeps them under MEDIA_ROOT and S3VideoStorage in an
+S3-compatible bucket (``pip install boto3``). On top of the Storage API both
+provide ``local_path(name)`` for ffmpeg, ``store(path, name)`` to move a
+finished local file in, and ``serve(request, name)`` to answer playback
+requests, handing the bytes to the front proxy or the object store where
+possible.
+"""
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, Storage, storages
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.deconstruct import deconstructible
+from django.utils.encoding import iri_to_uri
+from django.utils.functional import cached_property
+from django.utils.http import http_date
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def video_storage():
+    return storages['videos']
+
+
+@contextmanager
+def staging_directory():
+    """
+    Scratch space for files on their way into the video storage, under
+    VIDEO_UPLOAD_PATH so LocalVideoStorage.store() is a rename.
+    """
+    os.makedirs(settings.VIDEO_UPLOAD_PATH, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=settings.VIDEO_UPLOAD_PATH) as directory:
+        yield directory
+
+
+def content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def byte_range(header, size):
+    """
+    ``(first, last)`` byte of a single-range ``Range`` header, or None to send
+    the whole file. Raises ValueError when the range cannot be satisfied:
+    it starts past the end, or the file is empty.
+    """
+    match = RANGE.match(header or '')
+    # Multiple ranges are allowed to be answered with the whole file
+    if not match or not any(match.groups()):
+        return None
+    if size == 0:
+        raise ValueError('Empty file.')
+    first, last = match.groups()
+    if not first:
+        # bytes=-N: the last N bytes
+        if int(last) == 0:
+            raise ValueError('Empty suffix range.')
+        return max(size - int(last), 0), size - 1
+    first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        raise ValueError('Range starts past the end of the file.')
+    return (first, last) if first <= last else None
+
+
+def read_range(file, length):
+    with file:
+        while length > 0:
+            data = file.read(min(settings.VIDEO_STREAM_CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def ranged_file_response(request, path, name):
+    """Stream ``path`` from Python, honouring Range and If-Range."""
+    stat = os.stat(path)
+    last_modified = http_date(stat.st_mtime)
+    header = request.headers.get('Range')
+    if request.headers.get('If-Range', last_modified) != last_modified:
+        # The client's copy is stale: send it the whole file again
+        header = None
+    try:
+        requested = byte_range(header, stat.st_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    file = open(path, 'rb')
+    if requested is None:
+        # A full file goes out through the server's wsgi.file_wrapper, which may use sendfile
+        response = FileResponse(file, content_type=content_type(name))
+    else:
+        first, last = requested
+        file.seek(first)
+        response = StreamingHttpResponse(read_range(file, last - first + 1), status=206, content_type=content_type(name))
+        response['Content-Length'] = str(last - first + 1)
+        response['Content-Range'] = f'bytes {first}-{last}/{stat.st_size}'
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = last_modified
+    return response
+
+
+@deconstructible(path='products.storage.LocalVideoStorage')
+class LocalVideoStorage(FileSystemStorage):
+    """
+    Videos on local disk. With VIDEO_SENDFILE set, responses only name the
+    file and the front proxy sends it (Range requests included).
+    """
+
+    @contextmanager
+    def local_path(self, name):
+        yield self.path(name)
+
+    def store(self, path, name):
+        """Move the local file ``path`` to ``name``, replacing any file there."""
+        destination = self.path(name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.move(path, destination)
+        return name
+
+    def serve(self, request, name):
+        if settings.VIDEO_SENDFILE == 'x-accel-redirect':
+            response = HttpResponse(content_type=content_type(name))
+            response['X-Accel-Redirect'] = iri_to_uri(settings.VIDEO_ACCEL_REDIRECT_PREFIX + name)
+            return response
+        if settings.VIDEO_SENDFILE == 'x-sendfile':
+            response = HttpResponse(content_type=content_type(name))
+            response['X-Sendfile'] = self.path(name)
+            return response
+        return ranged_file_response(request, self.path(name), name)
+
+
+@deconstructible(path='products.storage.S3VideoStorage')
+class S3VideoStorage(Storage):
+    """
+    Videos in an S3-compatible bucket. Playback redirects to a presigned URL,
+    so the object store serves the bytes and Range requests itself.
+    """
+
+    def __init__(self, bucket=None, endpoint_url=None, region=None, url_expiry=None):
+        self.bucket = bucket or settings.VIDEO_S3_BUCKET
+        self.endpoint_url = endpoint_url or settings.VIDEO_S3_ENDPOINT_URL
+        self.region = region or settings.VIDEO_S3_REGION
+        self.url_expiry = url_expiry or settings.VIDEO_S3_URL_EXPIRY
+
+    @cached_property
+    def client(self):
+        # Imported on first use, so processes that never touch videos skip botocore
+        import boto3
+        # Credentials come from the usual AWS_* variables or instance profile
+        return boto3.client('s3', endpoint_url=self.endpoint_url, region_name=self.region)
+
+    def _open(self, name, mode='rb'):
+        file = tempfile.SpooledTemporaryFile(max_size=settings.VIDEO_UPLOAD_BUFFER_SIZE)
+        self.client.download_fileobj(self.bucket, name, file)
+        file.seek(0)
+        return File(file, name)
+
+    def _save(self, name, content):
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        self.client.upload_fileobj(content, self.bucket, name, ExtraArgs={'ContentType': content_type(name)})
+        return name
+
+    def _head(self, name):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=name)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=name)
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def size(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['ContentLength']
+
+    def get_modified_time(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['LastModified']
+
+    def url(self, name):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': name}, ExpiresIn=self.url_expiry,
+        )
+
+    @contextmanager
+    def local_path(self, name):
+        # ffmpeg seeks around its input, so it gets a downloaded copy
+        with staging_directory() as directory:
+            path = os.path.join(directory, os.path.basename(name))
+            self.client.download_file(self.bucket, name, path)
+            yield path
+
+    def store(self, path, name):
+        """Upload the local file ``path`` as ``name``, replacing any object there, and remove it."""
+        self.client.upload_file(path, self.bucket, name, ExtraArgs={'ContentType': content_type(name)})
+        os.remove(path)
+        return name
+
+    def serve(self, request, name):
+        return HttpResponseRedirect(self.url(name))
@@ -1,62 +1,210 @@
-from celery import shared_task
-from .models import Product, Category
+from celery import shared_task, chord
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from .models import Product, Category, KeyRotationRange
+from .blind_index import build_tokens
+from . import counters
+from . import rotation
+from . import search
+from .progress import GenerationReporter, ProgressReporter, publish_progress
+from .storage import staging_directory, video_storage
+from .transcode import TranscodeError, extract_poster, probe_duration, transcode
 import os
 import random
 import logging
+from functools import partial
 
 logger = logging.getLogger(__name__)
 
+
+def _dummy_product_batch(start, count, category_ids):
+    # Draw the whole batch of category ids and prices in one go instead of per row
+    categories = random.choices(category_ids, k=count)
+    cents = random.choices(range(500, 10001), k=count)
+    return [
+        Product(
+            category_id=categories[offset],
+            title=f"Dummy Product {start + offset}",
+            description="This is a dummy product.",
+            price=Decimal(cents[offset]).scaleb(-2),
+            status="available"
+        )
+        for offset in range(count)
+    ]
+
+
+def insert_dummy_products(start, count, category_ids, batch_size, on_progress=None):
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        batch = _dummy_product_batch(start + created, size, category_ids)
+        with transaction.atomic():
+            Product.objects.bulk_create(batch, batch_size=size)
+            build_tokens(batch)
+            counters.count_created(batch)
+            transaction.on_commit(partial(search.index_products, batch))
+        created += size
+        if on_progress:
+            on_progress(created, count)
+    return created
+
+
 @shared_task
-def generate_dummy_products(num_products):
+def generate_dummy_categories(num_categories):
+    categories = Category.objects.bulk_create(
+        [Category(name=f"Dummy Category {i}") for i in range(num_categories)]
+    )
+    build_tokens(categories)
+    logger.info(f"Generated {len(categories)} dummy categories.")
+    return len(categories)
+
+
+# Progress is recorded under the task id (products.progress.get_generation_progress)
+@shared_task(bind=True)
+def generate_dummy_products(self, num_products, batch_size=None, workers=1):
+    batch_size = batch_size or settings.PRODUCT_GENERATION_BATCH_SIZE
+    job_id = self.request.id
     logger.info(f"Starting to generate {num_products} dummy products.")
-    category_ids = Category.objects.values_list('id', flat=True)
+    category_ids = list(Category.objects.values_list('id', flat=True))
     if not category_ids:
         logger.error("No categories found.")
+        if job_id:
+            GenerationReporter(job_id).set_status('failed', num_products)
         return
-    
-    for i in range(num_products):
-        Product.objects.create(
-            category_id=random.choice(category_ids),
-            title=f"Dummy Product {i}",
-            description="This is a dummy product.",
-            price=random.uniform(5.00, 100.00),
-            status="available"
-        )
-    logger.info(f"Finished generating {num_products} dummy products.")
+    if job_id:
+        GenerationReporter(job_id).set_status('running', num_products)
+
+    if workers > 1 and num_products > batch_size:
+        # Fan the chunks out across several workers and report once they all finish
+        span = -(-num_products // workers)
+        header = [
+            generate_dummy_products_chunk.s(start, min(span, num_products - start), batch_size, job_id)
+            for start in range(0, num_products, span)
+        ]
+        chord(header)(finish_dummy_products.s(num_products, job_id))
+        logger.info(f"Dispatched {len(header)} chunks of up to {span} dummy products.")
+        return
+
+    reporter = GenerationReporter(job_id) if job_id else None
+
+    def report(done, total):
+        logger.info(f"Generated {done}/{total} dummy products.")
+        if reporter:
+            reporter.update(done, total)
+
+    try:
+        created = insert_dummy_products(0, num_products, category_ids, batch_size, on_progress=report)
+    except Exception:
+        if reporter:
+            reporter.set_status('failed', num_products)
+        raise
+    if reporter:
+        reporter.set_status('completed', num_products)
+    logger.info(f"Finished generating {created} dummy products.")
+    return created
+
+
+# Stores its result: finish_dummy_products sums the chunk counts
+@shared_task(ignore_result=False)
+def generate_dummy_products_chunk(start, count, batch_size, job_id=None):
+    category_ids = list(Category.objects.values_list('id', flat=True))
+    reporter = GenerationReporter(job_id) if job_id else None
+
+    def report(done, total):
+        logger.info(f"Chunk at {start}: generated {done}/{total} dummy products.")
+        if reporter:
+            reporter.update(done, total)
+
+    try:
+        return insert_dummy_products(start, count, category_ids, batch_size, on_progress=report)
+    except Exception:
+        # The chord's callback never runs, so the job is marked failed here
+        if reporter:
+            reporter.set_status('failed')
+        raise
 
 
 @shared_task
-def process_video(product_id, video_file_path):
+def finish_dummy_products(results, num_products, job_id=None):
+    created = sum(results)
+    if job_id:
+        GenerationReporter(job_id).set_status('completed')
+    logger.info(f"Finished generating {created}/{num_products} dummy products.")
+    return created
+
+
+@shared_task
+def adjust_product_counts(deltas):
+    counters.adjust(deltas)
+
+
+@shared_task
+def reencrypt_range(range_id, batch_size=None):
+    rotation_range = KeyRotationRange.objects.get(pk=range_id)
+    rewritten = rotation.reencrypt(rotation_range, batch_size)
+    logger.info(f"Re-encrypted {rewritten} {rotation_range.model} rows from id {rotation_range.start_id}.")
+    return rewritten
+
+
+# Acknowledged only once done, so a video whose worker died is delivered again
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def process_video(self, product_id, video_name=None, video_file_path=None):
+    if video_name is None:
+        # Sent by the previous release, which queued the file's path under MEDIA_ROOT; drop in the next one
+        video_name = os.path.relpath(video_file_path, settings.MEDIA_ROOT)
+    # Claim the job atomically so a duplicate enqueue for the same upload is a no-op;
+    # a redelivery may take over the run its dead worker had claimed
+    claimable = ['pending', 'processing'] if (self.request.delivery_info or {}).get('redelivered') else ['pending']
+    claimed = Product.objects.filter(id=product_id, video_status__in=claimable).update(
+        video_status='processing', video_progress=0
+    )
+    if not claimed:
+        if not Product.objects.filter(id=product_id).exists():
+            return 'Product not found.'
+        return 'Video is not pending; another run has already claimed it.'
+
+    reporter = ProgressReporter(product_id)
+    renditions = settings.VIDEO_RENDITIONS
+    outputs = {}
+    # Anything failing past the claim must mark the video failed: a 'processing'
+    # row is never claimed again, so it would otherwise stay stuck
     try:
-        # Get the product instance
-        product = Product.objects.get(id=product_id)
-
-        # Check file size (20 MB limit)
-        file_size = os.path.getsize(video_file_path)
-        if file_size > 20 * 1024 * 1024:  # 20 MB
-            product.video_status = 'failed'
-            product.save()
-            return 'File size exceeds 20 MB limit.'
-
-        # Set video status to processing
-        product.video_status = 'processing'
-        product.save()
-
-        # Process the video (e.g., encoding, compressing)
-        # Simulating processing with a sleep
-        import time
-        for progress in range(0, 101, 10):  # Simulate progress from 0% to 100%
-            time.sleep(1)  # Simulating processing delay
-            product.video_progress = progress
-            product.save()
-
-        # Set video status to completed
-        product.video_status = 'completed'
-        product.video_progress = 100
-        product.save()
-
-        return 'Video processing completed successfully.'
-
-    except Product.DoesNotExist:
-        return 'Product not found.'
+        publish_progress(product_id, 'processing', 0)
+        storage = video_storage()
+
+        # Uploads are checked up front; this still guards files saved by other paths
+        if storage.size(video_name) > settings.VIDEO_MAX_UPLOAD_SIZE:
+            reporter.finish('failed')
+            return 'File size exceeds the upload limit.'
+
+        # Outputs are written to local scratch space, then stored under their final names
+        with storage.local_path(video_name) as source, staging_directory() as staging:
+            duration = probe_duration(source)
+            for index, rendition in enumerate(renditions):
+                name = f"videos/renditions/{product_id}/{rendition['name']}.mp4"
+
+                def on_progress(fraction, index=index):
+                    # Spread 0-95% across the renditions; the poster takes the rest
+                    reporter.update(int((index + fraction) / len(renditions) * 95))
+
+                output = os.path.join(staging, f"{rendition['name']}.mp4")
+                transcode(source, output, rendition, duration=duration, on_progress=on_progress)
+                outputs[rendition['name']] = storage.store(output, name)
+
+            output = os.path.join(staging, 'poster.jpg')
+            extract_poster(source, output, duration=duration)
+            poster = storage.store(output, f'videos/posters/{product_id}.jpg')
+    except TranscodeError as e:
+        logger.error(f"Transcoding video for product {product_id} failed: {e}")
+        reporter.finish('failed')
+        return 'Video processing failed.'
+    except Exception:
+        # Missing ffmpeg/ffprobe, a vanished source file, a storage error...
+        logger.exception(f"Processing video for product {product_id} failed.")
+        reporter.finish('failed')
+        raise
 
+    Product.objects.filter(pk=product_id).update(video_renditions=outputs, video_poster=poster)
+    reporter.finish('completed', progress=100)
+    return 'Video processing completed successfully.'
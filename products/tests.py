@@ -1,3 +1,1199 @@
-from django.test import TestCase
+import asyncio
+import contextvars
+import csv
+import gzip
+import importlib.util
+import io
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.checks import Error
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils.http import http_date
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from e_commerce_proj import instrumentation
+from e_commerce_proj.db_routers import ReadReplicaRouter, read_alias, replica_reads
+
+from . import async_views, counters, pubsub, rotation
+from . import cache as api_cache
+
+from .authentication import CachedJWTAuthentication, RoleRefreshToken
+from .checks import check_blind_index_key, check_encryption_key
+from .fields import Ciphertext
+from .importer import import_products, write_batch
+from .management.commands.benchmark_startup import WEB_BOOT, WORKER_BOOT
+from .search import SearchIndex, search_index
+from .progress import GenerationReporter, get_generation_progress, get_progress, publish_progress, queue_generation
+from .storage import S3VideoStorage, byte_range, ranged_file_response
+from .models import Category, KeyRotationRange, Product, ProductCount, ProductImport, UserProfile, VideoUploadSession
+from .tasks import adjust_product_counts, finish_dummy_products, generate_dummy_products_chunk, insert_dummy_products, process_video
+from .transcode import TranscodeError, run_ffmpeg
+from .utils import blind_index, get_cipher
+from .views import ProductCursorPagination, VideoUploadSessionView
+
+# Stand-in for ffmpeg/ffprobe: reports progress, writes the output file (the
+# last argument) and fails for sources named *fail*
+STUB_FFMPEG = """#!/bin/sh
+for a in "$@"; do last="$a"; done
+case "$*" in *fail*) echo "boom" >&2; exit 1;; esac
+echo "out_time_us=1000000"
+echo "progress=end"
+echo data > "$last"
+"""
+STUB_FFPROBE = """#!/bin/sh
+echo 2.0
+"""
+
+
+class IsolatedTestCase(TestCase):
+    """Runs with its own encryption key, media directory and search index."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.settings_override = override_settings(
+            ENCRYPTION_KEYS={'default': 'test-key'},
+            ENCRYPTION_PREVIOUS_KEYS={'default': []},
+            MEDIA_ROOT=os.path.join(cls.directory, 'media'),
+            VIDEO_UPLOAD_PATH=os.path.join(cls.directory, 'media', 'videos'),
+            SEARCH_INDEX_PATH=os.path.join(cls.directory, 'search.sqlite3'),
+        )
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def setUp(self):
+        # API calls are made as a staff user, authenticated by the role claim in their token
+        self.user = UserProfile.objects.create_user('staff', 'staff@example.com', 'staff', role='staff')
+        self.token = RoleRefreshToken.for_user(self.user).access_token
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {self.token}'
+
+    def write_script(self, name, body):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as script:
+            script.write(body)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        return path
+
+
+class ProcessVideoTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        binaries = override_settings(
+            FFMPEG_BINARY=self.write_script('ffmpeg', STUB_FFMPEG),
+            FFPROBE_BINARY=self.write_script('ffprobe', STUB_FFPROBE),
+        )
+        binaries.enable()
+        self.addCleanup(binaries.disable)
+        self.category = Category.objects.create(name='Videos')
+
+    def create_product(self, filename='clip.mp4'):
+        # Not committed, so trigger_video_processing never enqueues it; the tests run the task
+        return Product.objects.create(
+            category=self.category, title='Clip', description='', price=1,
+            video=SimpleUploadedFile(filename, b'0' * 64),
+        )
+
+    def run_task(self, product):
+        return process_video.apply(kwargs={'product_id': product.pk, 'video_name': product.video.name})
+
+    def test_completed(self):
+        product = self.create_product()
+        result = self.run_task(product)
+        product.refresh_from_db()
+        self.assertEqual(result.result, 'Video processing completed successfully.')
+        self.assertEqual((product.video_status, product.video_progress), ('completed', 100))
+        self.assertEqual(set(product.video_renditions), {'720p', '480p'})
+        self.assertTrue(product.video_poster.storage.exists(product.video_poster.name))
+
+    def test_accepts_the_previous_release_path_argument(self):
+        product = self.create_product()
+        result = process_video.apply(kwargs={'product_id': product.pk, 'video_file_path': product.video.path})
+        self.assertEqual(result.result, 'Video processing completed successfully.')
+
+    def test_transcode_error_marks_failed(self):
+        product = self.create_product('fail.mp4')
+        self.assertEqual(self.run_task(product).result, 'Video processing failed.')
+        product.refresh_from_db()
+        self.assertEqual(product.video_status, 'failed')
+
+    def test_missing_binary_marks_failed(self):
+        product = self.create_product()
+        with override_settings(FFPROBE_BINARY=os.path.join(self.directory, 'missing')):
+            with self.assertRaises(FileNotFoundError):
+                self.run_task(product)
+        product.refresh_from_db()
+        self.assertEqual(product.video_status, 'failed')
+
+    def test_cache_error_after_the_claim_marks_failed(self):
+        product = self.create_product()
+        with mock.patch('products.tasks.publish_progress', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                self.run_task(product)
+        product.refresh_from_db()
+        self.assertEqual(product.video_status, 'failed')
+
+    def test_missing_source_marks_failed(self):
+        product = self.create_product()
+        product.video.storage.delete(product.video.name)
+        with self.assertRaises(OSError):
+            self.run_task(product)
+        product.refresh_from_db()
+        self.assertEqual(product.video_status, 'failed')
+
+
+class RunFfmpegTests(IsolatedTestCase):
+    def test_large_error_output_does_not_block(self):
+        # Far more than a pipe buffer of errors before ffmpeg exits
+        ffmpeg = self.write_script('noisy-ffmpeg', '#!/bin/sh\nhead -c 1000000 /dev/zero | tr "\\0" x >&2\necho progress=end\nexit 1\n')
+        with override_settings(FFMPEG_BINARY=ffmpeg):
+            with self.assertRaises(TranscodeError) as raised:
+                run_ffmpeg([])
+        self.assertEqual(len(str(raised.exception)), 1000000)
+
+
+class TimedTests(SimpleTestCase):
+    def setUp(self):
+        self.metrics = instrumentation.RequestMetrics()
+        token = instrumentation._current.set(self.metrics)
+        self.addCleanup(instrumentation._current.reset, token)
+
+    def test_overlapping_calls_keep_their_own_start(self):
+        @instrumentation.timed('work')
+        def work(seconds):
+            time.sleep(seconds)
+
+        threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(work, seconds))
+            for seconds in (0.05, 0.2)
+        ]
+        for thread in threads:
+            thread.start()
+            # The second call starts while the first is still running
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join()
+        self.assertGreaterEqual(self.metrics.timings['work'], 0.25)
+
+    def test_nested_calls_count_once(self):
+        timer = instrumentation.timed('work')
+
+        @timer
+        def outer():
+            inner()
+            time.sleep(0.05)
+
+        @timer
+        def inner():
+            time.sleep(0.05)
+
+        outer()
+        self.assertLess(self.metrics.timings['work'], 0.15)
+        self.assertEqual(outer.__name__, 'outer')
+
+
+class VideoUploadTests(IsolatedTestCase):
+    data = bytes(range(256)) * 40
+
+    def setUp(self):
+        super().setUp()
+        product = Product.objects.create(category=Category.objects.create(name='Videos'), title='Clip', description='', price=1)
+        self.session = VideoUploadSession.objects.create(product=product, filename='clip.mp4', size=len(self.data))
+
+    def put(self, first, last):
+        return self.client.put(
+            f'/api/video/uploads/{self.session.pk}/', self.data[first:last + 1],
+            content_type='application/octet-stream', HTTP_CONTENT_RANGE=f'bytes {first}-{last}/{len(self.data)}',
+        )
+
+    def stored(self):
+        with open(self.session.partial_path, 'rb') as partial:
+            return partial.read()
+
+    def test_overlapping_retry_appends_only_new_bytes(self):
+        self.assertEqual(self.put(0, 4999).json()['received'], 5000)
+        self.assertEqual(self.put(3000, 10239).json()['received'], 10240)
+        self.assertEqual(self.stored(), self.data)
+
+    def test_gap_is_refused(self):
+        self.assertEqual(self.put(100, 199).status_code, 409)
+
+    def test_request_that_read_a_stale_offset_does_not_rewind(self):
+        self.put(0, 10239)
+        # A retry of the first chunk that loaded the session before the full upload landed
+        stale = VideoUploadSession.objects.get(pk=self.session.pk)
+        stale.received = 0
+        with mock.patch.object(VideoUploadSessionView, 'get_object', return_value=stale):
+            self.assertEqual(self.put(0, 4999).json()['received'], 10240)
+        self.assertEqual(self.stored(), self.data)
+
+
+
+class ProductListTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Listed')
+        self.other = Category.objects.create(name='Other')
+        # Prices repeat, so ordering by price relies on the id tie-break
+        self.products = [
+            Product.objects.create(category=self.category if n < 5 else self.other, title=f'Item {n}', description='',
+                                   price=n % 3, status='approved' if n % 2 else 'pending')
+            for n in range(7)
+        ]
+
+    def walk(self, **params):
+        pages, url = [], '/api/products/'
+        params.setdefault('page_size', 3)
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            pages.append([product['id'] for product in response.json()['results']])
+            url, params = response.json()['next'], {}
+        return pages
+
+    def test_cursor_pages_cover_every_row_once(self):
+        pages = self.walk()
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), [product.pk for product in reversed(self.products)])
+
+    def test_ordering_by_price(self):
+        expected = sorted(self.products, key=lambda product: (product.price, product.pk))
+        self.assertEqual(sum(self.walk(ordering='price'), []), [product.pk for product in expected])
+
+    def test_filters(self):
+        self.assertEqual(sum(self.walk(status='approved', category=self.category.pk), []), [self.products[3].pk, self.products[1].pk])
+        self.assertEqual(sum(self.walk(min_price='2', max_price='2'), []), [self.products[5].pk, self.products[2].pk])
+        self.assertEqual(self.client.get('/api/products/', {'min_price': 'cheap'}).status_code, 400)
+
+
+class ProductBulkTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Bulk')
+
+    def post_ndjson(self, lines):
+        return self.client.post('/api/products/bulk/', '\n'.join(lines), content_type='application/x-ndjson')
+
+    def test_invalid_line_is_reported_in_place(self):
+        lines = [f'{{"category": {self.category.pk}, "title": "Item", "description": "Thing", "price": "1.00"}}', '{not json']
+        with override_settings(PRODUCT_BULK_CHUNK_SIZE=1):
+            response = self.post_ndjson(lines)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.json()['results']], ['created', 'error'])
+        self.assertIn('Line 2', response.json()['results'][1]['errors']['non_field_errors'][0])
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_update_leaves_fields_it_does_not_set_untouched(self):
+        first, second = (
+            Product.objects.create(category=self.category, title=f'Item {n}', description=f'About {n}', price=1)
+            for n in (1, 2)
+        )
+        stored = dict(Product.objects.values_list('pk', 'description'))
+        response = self.client.post('/api/products/bulk/', [
+            {'id': first.pk, 'title': 'Renamed'},
+            {'id': second.pk, 'description': 'Rewritten'},
+        ], content_type='application/json')
+        self.assertEqual([result['status'] for result in response.json()['results']], ['updated', 'updated'])
+        # Not decrypted and encrypted again with a fresh IV
+        self.assertEqual(Product.objects.values_list('description', flat=True).get(pk=first.pk), stored[first.pk])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.title, first.description), ('Renamed', 'About 1'))
+        self.assertEqual((second.title, second.description), ('Item 2', 'Rewritten'))
+
+
+    def test_invalid_ids_are_reported_per_item(self):
+        product = Product.objects.create(category=self.category, title='Item', description='Thing', price=1)
+        kept = Product.objects.create(category=self.category, title='Kept', description='Thing', price=1)
+        response = self.client.post('/api/products/bulk/', [
+            {'id': 'abc', 'title': 'Renamed'},
+            {'id': [product.pk], 'title': 'Renamed'},
+            {'op': 'delete', 'id': {'pk': kept.pk}},
+            {'op': 'delete'},
+            {'id': str(product.pk), 'title': 'Renamed'},
+            {'op': 'delete', 'id': str(kept.pk)},
+        ], content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['error', 'error', 'error', 'error', 'updated', 'deleted'])
+        for result in results[:4]:
+            self.assertIn('id', result['errors'])
+        self.assertEqual([results[4]['id'], results[5]['id']], [product.pk, kept.pk])
+        product.refresh_from_db()
+        self.assertEqual(product.title, 'Renamed')
+        self.assertFalse(Product.objects.filter(pk=kept.pk).exists())
+
+
+
+class BlindIndexLookupTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Garden Tools')
+        self.spade, self.rake = (
+            Product.objects.create(category=self.category, title=title, description='', price=1)
+            for title in ('Steel Garden Spade', 'Wooden rake')
+        )
+
+    def test_exact(self):
+        self.assertEqual(list(Product.objects.blind_exact('title', '  steel GARDEN   spade')), [self.spade])
+        self.assertEqual(list(Product.objects.blind_exact('title', 'Steel Garden')), [])
+        self.assertEqual(list(Category.objects.blind_exact('name', 'garden tools')), [self.category])
+
+    def test_prefix(self):
+        self.assertEqual(list(Product.objects.blind_prefix('title', 'gard')), [self.spade])
+        self.assertEqual(list(Product.objects.blind_prefix('title', 'spa stee')), [self.spade])
+        self.assertEqual(list(Product.objects.blind_prefix('title', 'spade rake')), [])
+        self.assertEqual(list(Product.objects.blind_prefix('title', 'WOOD')), [self.rake])
+        self.assertEqual(list(Category.objects.blind_prefix('name', 'too')), [self.category])
+
+    def test_tokens_follow_changes(self):
+        self.rake.title = 'Bamboo rake'
+        self.rake.save()
+        self.assertEqual(list(Product.objects.blind_prefix('title', 'bamb')), [self.rake])
+        self.assertEqual(list(Product.objects.blind_prefix('title', 'wood')), [])
+        self.assertEqual(list(Product.objects.blind_exact('title', 'bamboo rake')), [self.rake])
+        # Saves that leave the title alone keep its tokens
+        self.rake.price = 2
+        self.rake.save(update_fields=['price'])
+        self.assertEqual(list(Product.objects.blind_prefix('title', 'bamb')), [self.rake])
+
+
+
+class ImportProductsTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Imported')
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        return path
+
+    def ndjson(self, name, count):
+        return self.write(name, [
+            json.dumps({'category': 'imported', 'title': f'Crate {n}', 'description': f'Crate number {n}', 'price': f'{n}.50'})
+            for n in range(count)
+        ])
+
+    def test_invalid_records_are_skipped(self):
+        path = self.write('mixed.ndjson', [
+            json.dumps({'category': 'Imported', 'title': 'Crate', 'price': '3.50', 'status': 'approved'}),
+            json.dumps({'category': 'Imported', 'title': 'Crate', 'price': '3.505'}),
+            json.dumps({'category': 'Missing', 'title': 'Crate', 'price': '1'}),
+            '[1, 2]',
+        ])
+        errors = []
+        checkpoint = import_products(path, 'ndjson', processes=0, on_error=lambda number, message: errors.append(number))
+        self.assertEqual((checkpoint.position, checkpoint.imported, checkpoint.skipped), (4, 1, 3))
+        self.assertEqual(errors, [2, 3, 4])
+        product = Product.objects.get()
+        self.assertEqual((product.title, product.price, product.status), ('Crate', Decimal('3.50'), 'approved'))
+        self.assertEqual(list(Product.objects.blind_prefix('title', 'cra')), [product])
+
+    def test_resumes_after_the_last_batch_written(self):
+        path = self.ndjson('crates.ndjson', 5)
+        written = []
+
+        def killed_after_one_batch(*args):
+            if written:
+                raise RuntimeError('Killed')
+            written.append(write_batch(*args))
+
+        with mock.patch('products.importer.write_batch', side_effect=killed_after_one_batch), self.assertRaises(RuntimeError):
+            import_products(path, 'ndjson', batch_size=2, processes=0)
+        checkpoint = ProductImport.objects.get(source=path)
+        self.assertEqual((checkpoint.position, checkpoint.imported), (2, 2))
+
+        checkpoint = import_products(path, 'ndjson', batch_size=2, processes=0)
+        self.assertEqual((checkpoint.position, checkpoint.imported, checkpoint.skipped), (5, 5, 0))
+        self.assertEqual(sorted(product.title for product in Product.objects.all()), [f'Crate {n}' for n in range(5)])
+        # Nothing left to read
+        self.assertEqual(import_products(path, 'ndjson', processes=0).imported, 5)
+        self.assertEqual(Product.objects.count(), 5)
+
+    def test_command_reads_the_csv_export(self):
+        path = os.path.join(self.directory, 'export.csv.gz')
+        with gzip.open(path, 'wt', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['ID', 'Category', 'Title', 'Description', 'Price', 'Status'])
+            writer.writerow(['7', 'New shelf', 'Lamp', 'Brass, "tall"', '12.00', 'approved'])
+        out = io.StringIO()
+        call_command('import_products', path, '--processes', '0', '--create-categories', stdout=out, stderr=io.StringIO())
+        self.assertIn('Imported 1 products (0 skipped) from 1 records.', out.getvalue())
+        product = Product.objects.select_related('category').get()
+        self.assertEqual((product.category.name, product.title, product.description), ('New shelf', 'Lamp', 'Brass, "tall"'))
+
+
+@override_settings(BLIND_INDEX_KEY=None, ENCRYPTION_KEYS={'default': 'new-key'}, ENCRYPTION_PREVIOUS_KEYS={'default': ['old-key']})
+class BlindIndexKeyTests(IsolatedTestCase):
+    def test_rotation_requires_its_own_key(self):
+        self.assertIsInstance(check_blind_index_key(None)[0], Error)
+        with self.assertRaises(ImproperlyConfigured):
+            blind_index('title')
+        with self.assertRaises(ImproperlyConfigured):
+            rotation.start()
+
+    def test_own_key_outlives_rotation(self):
+        with override_settings(BLIND_INDEX_KEY='index-key'):
+            self.assertEqual(check_blind_index_key(None), [])
+            rotated = blind_index('title')
+        with override_settings(BLIND_INDEX_KEY='index-key', ENCRYPTION_PREVIOUS_KEYS={'default': []}):
+            self.assertEqual(blind_index('title'), rotated)
+
+
+@override_settings(BLIND_INDEX_KEY='index-key')
+class ReencryptTests(IsolatedTestCase):
+    def test_rewrites_only_stale_fields(self):
+        category = Category.objects.create(name='Rotated')
+        products = [Product.objects.create(category=category, title='Title', description='Text', price=1) for _ in range(3)]
+        # Ciphertext is saved as it is, not encrypted again
+        old = Ciphertext(get_cipher().encrypt('Old'))
+        with override_settings(ENCRYPTION_KEYS={'default': 'new-key'}, ENCRYPTION_PREVIOUS_KEYS={'default': ['test-key']}):
+            cipher = get_cipher()
+            new = Ciphertext(cipher.encrypt('New'))
+            for product, (title, description) in zip(products, [(old, new), (new, old), (new, new)]):
+                Product.objects.filter(pk=product.pk).update(title=title, description=description)
+            rotation_range = KeyRotationRange.objects.create(
+                model='products.product', key_id=cipher.key_id, start_id=1, end_id=products[-1].pk + 1, position=0,
+            )
+            self.assertEqual(rotation.reencrypt(rotation_range), 2)
+            rotation_range.refresh_from_db()
+            self.assertEqual((rotation_range.rewritten, rotation_range.completed), (2, True))
+            rows = [tuple(Product.objects.values_list('title', 'description').get(pk=product.pk)) for product in products]
+            # The field that was already current is left as it was
+            self.assertEqual((rows[0][1], rows[1][0], rows[2]), (new, new, (new, new)))
+            self.assertTrue(all(value.startswith(cipher.prefix) for row in rows for value in row))
+            self.assertEqual([(product.title, product.description) for product in Product.objects.order_by('pk')], [
+                ('Old', 'New'), ('New', 'Old'), ('New', 'New'),
+            ])
+
+
+class VideoProgressTests(IsolatedTestCase):
+    def test_new_upload_replaces_cached_progress(self):
+        product = Product.objects.create(category=Category.objects.create(name='Videos'), title='Clip', description='', price=1)
+        publish_progress(product.pk, 'completed', 100)
+        product.video = SimpleUploadedFile('clip.mp4', b'0' * 64)
+        product.video_status, product.video_progress = 'pending', 0
+        with mock.patch.object(process_video, 'delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        delay.assert_called_once()
+        self.assertEqual(get_progress(product.pk), {'video_status': 'pending', 'video_progress': 0})
+
+
+class ProductCountTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Counted')
+
+    def create_products(self, prices):
+        with self.captureOnCommitCallbacks(execute=True):
+            return [Product.objects.create(category=self.category, title='Item', description='', price=price) for price in prices]
+
+    def test_cascading_delete_sends_one_task(self):
+        self.create_products([1, 2, 3])
+        with mock.patch.object(adjust_product_counts, 'delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/categories/{self.category.pk}/').status_code, 204)
+        delay.assert_called_once_with([[self.category.pk, 'pending', -3, '-6.00']])
+
+    def test_rolled_back_savepoint_is_not_counted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Product.objects.create(category=self.category, title='Kept', description='', price=5)
+                try:
+                    with transaction.atomic():
+                        Product.objects.create(category=self.category, title='Undone', description='', price=7)
+                        raise ValueError
+                except ValueError:
+                    pass
+        rollup = ProductCount.objects.get(category=self.category)
+        self.assertEqual((rollup.count, rollup.price_total), (1, 5))
+
+    def test_collect_queues_nothing_when_the_block_raises(self):
+        products = self.create_products([1])
+        with mock.patch.object(adjust_product_counts, 'delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), counters.collect():
+                counters.count_deleted(products)
+                raise ValueError
+        delay.assert_not_called()
+
+
+
+
+@override_settings(PRODUCT_EXPORT_CHUNK_SIZE=2)
+class ExportProductsCSVTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        admin = UserProfile.objects.create_user('admin', 'admin@example.com', 'admin', role='admin')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RoleRefreshToken.for_user(admin).access_token}'
+        category = Category.objects.create(name='Exported')
+        self.products = [
+            Product.objects.create(category=category, title=f'Item {n}', description=f'About, "{n}"', price=n,
+                                   status='approved' if n % 2 else 'pending')
+            for n in range(1, 6)
+        ]
+
+    def export(self, **params):
+        response = self.client.get('/api/export/products/csv/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content)
+        if params.get('compress') == 'gzip':
+            content = gzip.decompress(content)
+        return list(csv.reader(io.StringIO(content.decode())))
+
+    def test_every_row_across_batches(self):
+        rows = self.export(columns='id,category,title,description,price')
+        self.assertEqual(rows[0], ['ID', 'Category', 'Title', 'Description', 'Price'])
+        self.assertEqual(rows[1:], [
+            [str(product.pk), 'Exported', f'Item {n}', f'About, "{n}"', f'{n}.00']
+            for n, product in enumerate(self.products, 1)
+        ])
+
+    def test_filters_and_gzip(self):
+        rows = self.export(columns='title', status='approved', compress='gzip')
+        self.assertEqual(rows, [['Title'], ['Item 1'], ['Item 3'], ['Item 5']])
+
+    def test_unknown_column(self):
+        response = self.client.get('/api/export/products/csv/', {'columns': 'title,secret'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_admin_only(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {self.token}'
+        self.assertEqual(self.client.get('/api/export/products/csv/').status_code, 403)
+
+
+@override_settings(DASHBOARD_PAGE_SIZE=2)
+class DashboardTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        category = Category.objects.create(name='Shelf')
+        self.pending = [
+            Product.objects.create(category=category, title=f'Pending {n}', description='', price=1) for n in range(5)
+        ][::-1]
+        self.approved = [
+            Product.objects.create(category=category, title=f'Approved {n}', description='', price=1, status='approved')
+            for n in range(3)
+        ][::-1]
+
+    def get(self, query=''):
+        response = self.client.get(f'/api/dashboard/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.context
+
+    def test_pages_keep_the_other_lists_in_place(self):
+        context = self.get()
+        self.assertEqual(context['pending_products']['items'], self.pending[:2])
+        self.assertFalse(context['pending_products']['has_previous'])
+        context = self.get(context['approved_products']['next_query'])
+        self.assertEqual(context['approved_products']['items'], self.approved[2:])
+        self.assertFalse(context['approved_products']['has_next'])
+        context = self.get(context['pending_products']['next_query'])
+        self.assertEqual(context['pending_products']['items'], self.pending[2:4])
+        # Paging the pending list left the approved one on its second page
+        self.assertEqual(context['approved_products']['items'], self.approved[2:])
+        context = self.get(context['pending_products']['next_query'])
+        self.assertEqual(context['pending_products']['items'], self.pending[4:])
+        self.assertFalse(context['pending_products']['has_next'])
+        context = self.get(context['pending_products']['previous_query'])
+        self.assertEqual(context['pending_products']['items'], self.pending[2:4])
+        self.assertTrue(context['pending_products']['has_previous'])
+        context = self.get(context['pending_products']['previous_query'])
+        self.assertEqual(context['pending_products']['items'], self.pending[:2])
+        self.assertFalse(context['pending_products']['has_previous'])
+
+    def test_each_category_is_decrypted_once_per_page(self):
+        cipher = get_cipher()
+        with mock.patch.object(type(cipher), 'decrypt', autospec=True, side_effect=type(cipher).decrypt) as decrypt:
+            context = self.get()
+        # Two titles and one category name for each of the pending and approved pages
+        self.assertEqual(decrypt.call_count, 6)
+        first, second = context['pending_products']['items']
+        self.assertIs(first.category, second.category)
+        self.assertEqual(first.category.name, 'Shelf')
+
+    def test_invalid_cursor_is_the_first_page(self):
+        self.assertEqual(self.get('pending_page=after:garbage')['pending_products']['items'], self.pending[:2])
+
+
+
+class SearchTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        index = override_settings(SEARCH_INDEX_PATH=os.path.join(self.directory, f'{self._testMethodName}.sqlite3'))
+        index.enable()
+        self.addCleanup(index.disable)
+        self.category = Category.objects.create(name='Wardrobe')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.red_shoe, self.blue_shoe, self.red_hat = (
+                Product.objects.create(category=self.category, title=title, description=description, price=price, status=status)
+                for title, description, price, status in [
+                    ('Red shoe', 'Leather', 50, 'pending'),
+                    ('Blue shoe', 'Suede', 80, 'approved'),
+                    ('Red hat', 'Wool, fits shoe racks', 20, 'approved'),
+                ]
+            )
+
+    def search(self, **params):
+        response = self.client.get('/api/products/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [result['id'] for result in response.json()['results']]
+
+    def test_words_match_as_prefixes(self):
+        # Title matches outrank description ones
+        self.assertEqual(self.search(q='sho')[2], self.red_hat.pk)
+        self.assertEqual(self.search(q='red sh'), [self.red_shoe.pk, self.red_hat.pk])
+        self.assertEqual(self.search(q='shoe', status='approved', min_price='50'), [self.blue_shoe.pk])
+        self.assertEqual(self.search(q='"); DROP'), [])
+
+    def test_cascading_delete_is_one_index_write(self):
+        with mock.patch.object(SearchIndex, 'remove', autospec=True, side_effect=SearchIndex.remove) as remove:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.client.delete(f'/api/categories/{self.category.pk}/').status_code, 204)
+        remove.assert_called_once()
+        self.assertEqual(sorted(remove.call_args.args[1]), sorted([self.red_shoe.pk, self.blue_shoe.pk, self.red_hat.pk]))
+        self.assertEqual(search_index().search('red'), [])
+
+    def test_products_deleted_during_a_rebuild_stay_out(self):
+        def batches():
+            batch = list(Product.objects.order_by('pk'))
+            # Deleted after the rebuild read it
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.get(pk=self.red_hat.pk).delete()
+            yield batch
+
+        self.assertEqual(search_index().rebuild(batches()), 3)
+        self.assertEqual([pk for pk, _ in search_index().search('red')], [self.red_shoe.pk])
+
+    def test_rebuild_command(self):
+        search_index().remove([self.red_shoe.pk, self.blue_shoe.pk, self.red_hat.pk])
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 products', out.getvalue())
+        self.assertEqual(len(search_index().search('shoe')), 3)
+
+
+class ByteRangeTests(SimpleTestCase):
+    def test_ranges(self):
+        self.assertEqual(byte_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(byte_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(byte_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(byte_range('bytes=-5000', 1000), (0, 999))
+        self.assertIsNone(byte_range('bytes=0-9,20-29', 1000))
+        self.assertIsNone(byte_range(None, 1000))
+
+    def test_unsatisfiable(self):
+        for header, size in [('bytes=1000-', 1000), ('bytes=-0', 1000), ('bytes=-5', 0), ('bytes=0-', 0)]:
+            with self.subTest(header=header, size=size), self.assertRaises(ValueError):
+                byte_range(header, size)
+
+
+class RangedFileResponseTests(IsolatedTestCase):
+    data = bytes(range(256)) * 4
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.directory, 'video.mp4')
+        with open(self.path, 'wb') as file:
+            file.write(self.data)
+
+    def get(self, **headers):
+        request = RequestFactory().get('/', headers=headers)
+        return ranged_file_response(request, self.path, 'video.mp4')
+
+    def test_partial_content(self):
+        response = self.get(Range='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(response.streaming_content), self.data[100:200])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(Range=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_if_range(self):
+        current = http_date(os.stat(self.path).st_mtime)
+        response = self.get(Range='bytes=0-9', **{'If-Range': current})
+        self.assertEqual((response.status_code, b''.join(response.streaming_content)), (206, self.data[:10]))
+        # The client's copy is out of date, so it gets the whole file
+        response = self.get(Range='bytes=0-9', **{'If-Range': http_date(0)})
+        self.assertEqual((response.status_code, b''.join(response.streaming_content)), (200, self.data))
+
+
+@override_settings(VIDEO_SENDFILE='x-accel-redirect', VIDEO_ACCEL_REDIRECT_PREFIX='/protected/')
+class ProductVideoViewTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Videos')
+        self.pending, self.approved = (
+            Product.objects.create(category=category, title='Clip', description='Video', price=1, status=status,
+                                   video=f'videos/{status}.mp4')
+            for status in ('pending', 'approved')
+        )
+
+    def get(self, product, **headers):
+        return self.client.get(f'/api/products/{product.pk}/video/', headers=headers)
+
+    def test_staff_play_any_video(self):
+        self.assertEqual(self.get(self.pending)['X-Accel-Redirect'], '/protected/videos/pending.mp4')
+        self.assertEqual(self.get(self.approved)['X-Accel-Redirect'], '/protected/videos/approved.mp4')
+
+    def test_others_only_play_approved_videos(self):
+        del self.client.defaults['HTTP_AUTHORIZATION']
+        self.assertEqual(self.get(self.pending).status_code, 404)
+        self.assertEqual(self.get(self.approved)['X-Accel-Redirect'], '/protected/videos/approved.mp4')
+        agent = UserProfile.objects.create_user('agent', 'agent@example.com', 'agent', role='agent')
+        token = RoleRefreshToken.for_user(agent).access_token
+        self.assertEqual(self.get(self.pending, Authorization=f'Bearer {token}').status_code, 404)
+
+
+@unittest.skipUnless(importlib.util.find_spec('boto3') and importlib.util.find_spec('moto'), 'boto3 and moto are not installed')
+class S3VideoStorageTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        from moto import mock_aws
+        credentials = mock.patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test'})
+        credentials.start()
+        self.addCleanup(credentials.stop)
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        self.storage = S3VideoStorage(bucket='videos', region='us-east-1')
+        self.storage.client.create_bucket(Bucket='videos')
+
+    def test_store_and_local_path(self):
+        path = os.path.join(self.directory, 'upload.mp4')
+        with open(path, 'wb') as file:
+            file.write(b'video')
+        self.assertEqual(self.storage.store(path, 'videos/clip.mp4'), 'videos/clip.mp4')
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.storage.size('videos/clip.mp4'), 5)
+        head = self.storage.client.head_object(Bucket='videos', Key='videos/clip.mp4')
+        self.assertEqual(head['ContentType'], 'video/mp4')
+        with self.storage.local_path('videos/clip.mp4') as local:
+            with open(local, 'rb') as file:
+                self.assertEqual(file.read(), b'video')
+        # The downloaded copy is scratch space
+        self.assertFalse(os.path.exists(local))
+
+    def test_serve_redirects_to_presigned_url(self):
+        self.storage.save('videos/clip.mp4', SimpleUploadedFile('clip.mp4', b'video'))
+        response = self.storage.serve(RequestFactory().get('/'), 'videos/clip.mp4')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/videos/clip.mp4', response['Location'])
+        self.assertIn('Signature', response['Location'])
+
+
+
+class DatabaseProfileTests(TestCase):
+    def test_sqlite_connection_settings(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+            cursor.execute('PRAGMA synchronous')
+            # NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_reads_go_to_the_replica_only_when_asked(self):
+        router = ReadReplicaRouter()
+        with mock.patch.dict(settings.DATABASES, {'replica': {}}):
+            self.assertIsNone(router.db_for_read(Product))
+            with replica_reads():
+                self.assertEqual(router.db_for_read(Product), 'replica')
+                self.assertEqual(router.db_for_write(Product), 'default')
+            self.assertIsNone(router.db_for_read(Product))
+            self.assertEqual(read_alias(), 'replica')
+            self.assertFalse(router.allow_migrate('replica', 'products'))
+        # No replica configured
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Product), 'default')
+
+
+
+
+class RoleTokenAuthenticationTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def authenticate(self, token=None):
+        request = RequestFactory().get('/', headers={'Authorization': f'Bearer {token or self.token}'})
+        return CachedJWTAuthentication().authenticate(request)[0]
+
+    def test_user_state_is_cached(self):
+        with self.assertNumQueries(1):
+            user = self.authenticate()
+        with self.assertNumQueries(0):
+            self.assertEqual((self.authenticate().id, user.role), (self.user.pk, 'staff'))
+
+    def test_changes_to_the_user_reject_old_tokens(self):
+        self.authenticate()
+        self.user.role = 'agent'
+        self.user.save()
+        with self.assertRaisesMessage(AuthenticationFailed, 'role has changed'):
+            self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaisesMessage(AuthenticationFailed, 'inactive'):
+            self.authenticate()
+        self.user.delete()
+        with self.assertRaisesMessage(AuthenticationFailed, 'not found'):
+            self.authenticate()
+
+    def test_refresh_picks_up_the_new_role(self):
+        refresh = RoleRefreshToken.for_user(self.user)
+        UserProfile.objects.filter(pk=self.user.pk).update(role='admin')
+        response = self.client.post(reverse('token_refresh'), {'refresh': str(refresh)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AccessToken(response.json()['access'])['role'], 'admin')
+
+    def test_token_without_role_loads_the_user(self):
+        token = RefreshToken.for_user(self.user).access_token
+        self.assertEqual(self.authenticate(token), self.user)
+
+
+class AsyncReadViewTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Async')
+        self.products = [
+            Product.objects.create(category=self.category, title=f'Item {n}', description=f'About {n}', price=n,
+                                   status='approved' if n % 2 else 'pending')
+            for n in range(5)
+        ][::-1]
+        self.headers = {'Authorization': f'Bearer {self.token}'}
+
+    async def get(self, path, status_code=200, **params):
+        response = await self.async_client.get(path, params, headers=self.headers)
+        self.assertEqual(response.status_code, status_code)
+        return response.json()
+
+    async def test_product_list_pages(self):
+        with mock.patch.object(ProductCursorPagination, 'page_size', 2):
+            seen, url, params = [], '/api/async/products/', {}
+            while url:
+                page = await self.get(url, **params)
+                seen += page['results']
+                url, params = page['next'], {}
+        self.assertEqual([product['id'] for product in seen], [product.pk for product in self.products])
+        self.assertEqual(seen[0]['title'], 'Item 4')
+        page = await self.get('/api/async/products/', status='approved')
+        self.assertEqual([product['title'] for product in page['results']], ['Item 3', 'Item 1'])
+        await self.get('/api/async/products/', 404, cursor='garbage')
+
+    async def test_detail_and_categories(self):
+        product = self.products[0]
+        self.assertEqual((await self.get(f'/api/async/products/{product.pk}/'))['description'], 'About 4')
+        await self.get('/api/async/products/0/', 404)
+        self.assertEqual([category['name'] for category in await self.get('/api/async/categories/')], ['Async'])
+
+    async def test_access(self):
+        self.assertEqual((await self.async_client.get('/api/async/categories/')).status_code, 401)
+        self.assertEqual((await self.async_client.post('/api/async/categories/')).status_code, 405)
+        agent = await UserProfile.objects.acreate(username='agent', role='agent')
+        self.headers = {'Authorization': f'Bearer {RoleRefreshToken.for_user(agent).access_token}'}
+        await self.get('/api/async/categories/', 403)
+
+
+@override_settings(PUBSUB_BROKER_URL=None, SSE_KEEPALIVE_INTERVAL=0.1)
+class ProductEventsTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        for product_id in (1, 2):
+            publish_progress(product_id, 'pending', 0)
+
+    async def test_local_broker_fans_out_to_every_listener(self):
+        broker = pubsub.LocalBroker()
+        listeners = []
+        for _ in range(2):
+            subscribed = asyncio.Event()
+            listener = broker.listen(subscribed)
+            listeners.append((listener, asyncio.ensure_future(anext(listener))))
+            await subscribed.wait()
+        # From another thread, as a Celery worker or sync view would
+        await asyncio.to_thread(broker.publish, {'product_id': 1})
+        for listener, received in listeners:
+            self.assertEqual(await received, {'product_id': 1})
+            await listener.aclose()
+        self.assertEqual(broker.listeners, set())
+
+    async def stream(self, *args, path='/api/async/products/events/'):
+        request = AsyncRequestFactory().get(path, headers={'Authorization': f'Bearer {self.token}'})
+        response = await async_views.product_events(request, *args)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return response.streaming_content
+
+    async def test_streams_current_state_then_changes(self):
+        single = await self.stream(1)
+        several = await self.stream(path='/api/async/products/events/?ids=1,2')
+        try:
+            pending = 'event: progress\ndata: {"product_id": %d, "video_status": "pending", "video_progress": 0}\n\n'
+            self.assertEqual(await anext(single), (pending % 1).encode())
+            self.assertEqual([await anext(several), await anext(several)], [(pending % 1).encode(), (pending % 2).encode()])
+
+            await asyncio.to_thread(publish_progress, 2, 'processing', 40)
+            self.assertEqual(
+                await anext(several),
+                b'event: progress\ndata: {"product_id": 2, "video_status": "processing", "video_progress": 40}\n\n',
+            )
+            # Product 2 is not watched by the first stream, which only keeps the connection alive
+            self.assertEqual(await anext(single), b': keepalive\n\n')
+        finally:
+            hub = pubsub.get_hub()
+            for subscription in list(hub.subscriptions):
+                hub.unsubscribe(subscription)
+
+
+class GenerateProductsTests(IsolatedTestCase):
+    def test_progress_is_reported_through_the_cache(self):
+        Category.objects.create(name='Generated')
+        for workers in (1, 3):
+            with self.subTest(workers=workers):
+                response = self.client.post('/api/generate-products/', {'num_products': 25, 'batch_size': 4, 'workers': workers})
+                self.assertEqual(response.status_code, 202)
+                job_id = response.json()['job_id']
+                self.assertEqual(self.client.get(f'/api/generate-products/{job_id}/').json(), {'status': 'completed', 'total': 25, 'done': 25})
+
+    def test_progress_does_not_depend_on_process_memory(self):
+        # Each step as a different worker would run it, with nothing cached in between
+        Category.objects.create(name='Generated')
+        queue_generation('job', 10)
+        GenerationReporter('job').set_status('running', 10)
+        generate_dummy_products_chunk.apply(args=(0, 6, 4, 'job'))
+        cache.clear()
+        self.assertEqual(self.client.get('/api/generate-products/job/').json(), {'status': 'running', 'done': 6, 'total': 10})
+        generate_dummy_products_chunk.apply(args=(6, 4, 4, 'job'))
+        finish_dummy_products.apply(args=([6, 4], 10, 'job'))
+        cache.clear()
+        self.assertEqual(self.client.get('/api/generate-products/job/').json(), {'status': 'completed', 'done': 10, 'total': 10})
+
+    def test_inserts_a_batch_per_transaction(self):
+        category = Category.objects.create(name='Generated')
+        progress = []
+        with mock.patch.object(Product.objects, 'bulk_create', wraps=Product.objects.bulk_create) as bulk_create:
+            with self.captureOnCommitCallbacks(execute=True):
+                created = insert_dummy_products(0, 10, [category.pk], 4, on_progress=lambda done, total: progress.append(done))
+        self.assertEqual(created, 10)
+        self.assertEqual([len(call.args[0]) for call in bulk_create.call_args_list], [4, 4, 2])
+        self.assertEqual(progress, [4, 8, 10])
+        self.assertEqual(ProductCount.objects.get(category=category).count, 10)
+        # Encrypted on the way in, and findable by title
+        product = Product.objects.get(title_index=blind_index('Dummy Product 9'))
+        self.assertTrue(Product.objects.filter(pk=product.pk).values_list('title', flat=True)[0].startswith('$1$'))
+        self.assertIn(product.pk, [pk for pk, _ in search_index().search('dummy product 9')])
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get('/api/generate-products/unknown/').status_code, 404)
+        self.assertIsNone(get_generation_progress('unknown'))
+
+
+class BenchmarkCommandTests(SimpleTestCase):
+    """The benchmark commands, run as from a fresh checkout: no migrations, no broker."""
+
+    def run_command(self, *args):
+        env = {**os.environ, 'ENCRYPTION_KEY': 'benchmark-key', 'CELERY_PROFILE': ''}
+        env.pop('REDIS_URL', None)
+        finished = subprocess.run(
+            [sys.executable, 'manage.py', *args],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=env, capture_output=True, text=True, timeout=300,
+        )
+        self.assertEqual(finished.returncode, 0, finished.stderr)
+        return json.loads(finished.stdout)
+
+    def test_benchmark_api(self):
+        results = self.run_command('benchmark_api', '--categories', '2', '--products', '20', '--requests', '2', '--concurrency', '1')
+        self.assertEqual(results['products'], 20)
+        self.assertEqual({result['errors'] for result in results['endpoints'].values()}, {0})
+
+    def test_benchmark_auth(self):
+        results = self.run_command('benchmark_auth', '--iterations', '10', '--requests', '2')
+        self.assertEqual({result['errors'] for result in results['endpoint'].values()}, {0})
+
+
+
+
+class EncryptedFieldTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Sealed')
+
+    def test_round_trip(self):
+        product = Product.objects.create(category=self.category, title='Lamp', description='Brass, 40 cm', price=12)
+        stored = Product.objects.filter(pk=product.pk).values_list('title', 'description').get()
+        self.assertTrue(all(isinstance(value, Ciphertext) and value.startswith('$1$') for value in stored))
+        self.assertNotIn('Lamp', stored[0])
+        product = Product.objects.get(pk=product.pk)
+        self.assertEqual((product.title, product.description, product.category.name), ('Lamp', 'Brass, 40 cm', 'Sealed'))
+
+    def test_decrypted_lazily_and_once(self):
+        Product.objects.create(category=self.category, title='Lamp', description='Brass', price=12)
+        cipher = get_cipher()
+        with mock.patch.object(type(cipher), 'decrypt', autospec=True, side_effect=type(cipher).decrypt) as decrypt:
+            product = Product.objects.get()
+            self.assertEqual(decrypt.call_count, 0)
+            self.assertEqual([product.title, product.title], ['Lamp', 'Lamp'])
+            self.assertEqual(decrypt.call_count, 1)
+
+    def test_unread_values_are_saved_untouched(self):
+        product = Product.objects.create(category=self.category, title='Lamp', description='Brass', price=12)
+        stored = Product.objects.values_list('title', flat=True).get(pk=product.pk)
+        product = Product.objects.get(pk=product.pk)
+        product.price = 15
+        product.save()
+        self.assertEqual(Product.objects.values_list('title', flat=True).get(pk=product.pk), stored)
+        product.title = 'Desk lamp'
+        product.save()
+        self.assertNotEqual(Product.objects.values_list('title', flat=True).get(pk=product.pk), stored)
+        self.assertEqual(Product.objects.get(pk=product.pk).title, 'Desk lamp')
+
+    def test_api_reads_and_writes_plaintext(self):
+        response = self.client.post('/api/products/', {
+            'category': self.category.pk, 'title': 'Lamp', 'description': 'Brass', 'price': '12.00',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        pk = response.json()['id']
+        self.assertTrue(Product.objects.values_list('title', flat=True).get(pk=pk).startswith('$1$'))
+        self.assertEqual(self.client.get(f'/api/products/{pk}/').json()['title'], 'Lamp')
+
+
+@override_settings(ENCRYPTION_KEYS={'default': 'test-key'}, ENCRYPTION_PREVIOUS_KEYS={'default': []})
+class CipherTests(SimpleTestCase):
+    def test_one_cipher_per_key(self):
+        cipher = get_cipher()
+        self.assertIs(get_cipher(), cipher)
+        with override_settings(ENCRYPTION_KEYS={'default': 'other-key'}):
+            self.assertIsNot(get_cipher(), cipher)
+            with self.assertRaises(ImproperlyConfigured):
+                get_cipher('archive')
+
+    def test_batch_round_trip(self):
+        values = [f'Value {n} \u00e9' for n in range(10)]
+        for threads in (1, 4):
+            with self.subTest(threads=threads), override_settings(ENCRYPTION_THREADS=threads, ENCRYPTION_PARALLEL_THRESHOLD=2):
+                encrypted = get_cipher().encrypt_many(values)
+                self.assertTrue(all(value.startswith(get_cipher().prefix) for value in encrypted))
+                self.assertEqual(get_cipher().decrypt_many(encrypted), values)
+        # A fresh IV every time
+        self.assertNotEqual(get_cipher().encrypt('Same'), get_cipher().encrypt('Same'))
+
+    def test_raw_on_error(self):
+        values = [get_cipher().encrypt('Secret'), 'Plain text']
+        self.assertEqual(get_cipher().decrypt_many(values, raw_on_error=True), ['Secret', 'Plain text'])
+        with self.assertRaises(ValueError):
+            get_cipher().decrypt_many(values)
+
+
+
+class StartupTests(SimpleTestCase):
+    def boot(self, script, modules):
+        """Which of ``modules`` a fresh interpreter has imported after running ``script``, without an encryption key."""
+        environment = {key: value for key, value in os.environ.items() if key != 'ENCRYPTION_KEY'}
+        environment['DJANGO_SETTINGS_MODULE'] = 'e_commerce_proj.settings'
+        script += f'import sys\nprint(*[module for module in {modules!r} if module in sys.modules])\n'
+        result = subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR, env=environment,
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout.split()
+
+    def test_worker_boot_skips_the_views(self):
+        self.assertEqual(self.boot(WORKER_BOOT, ['products.tasks', 'products.views', 'rest_framework.renderers']), ['products.tasks'])
+
+    def test_web_boot_needs_no_key_or_tasks(self):
+        self.assertEqual(self.boot(WEB_BOOT, ['products.views', 'products.tasks']), ['products.views'])
+
+    def test_missing_key_is_a_warning(self):
+        with override_settings(ENCRYPTION_KEYS={'default': None}):
+            self.assertEqual([message.id for message in check_encryption_key(None)], ['products.W001'])
+        with override_settings(ENCRYPTION_KEYS={'default': 'key'}):
+            self.assertEqual(check_encryption_key(None), [])
+
+
+class DecryptTests(IsolatedTestCase):
+    def test_value_under_a_missing_key_is_not_served_as_text(self):
+        category = Category.objects.create(name='Secret')
+        with override_settings(ENCRYPTION_KEYS={'default': 'retired-key'}):
+            ciphertext = Ciphertext(get_cipher().encrypt('Secret'))
+        Category.objects.filter(pk=category.pk).update(name=ciphertext)
+        with self.assertRaisesMessage(ValueError, 'is not configured'):
+            Category.objects.get(pk=category.pk).name
+
+    def test_unversioned_plaintext_passes_through(self):
+        category = Category.objects.create(name='Plain')
+        Category.objects.filter(pk=category.pk).update(name=Ciphertext('Written outside the API'))
+        self.assertEqual(Category.objects.get(pk=category.pk).name, 'Written outside the API')
+
+
+class ApiCacheTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        # A file-based cache is shared by every process on the host, unlike local memory
+        caches = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'api': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': os.path.join(self.directory, 'api-cache')},
+        })
+        caches.enable()
+        self.addCleanup(caches.disable)
+        self.category = Category.objects.create(name='Cached')
+        self.product = Product.objects.create(category=self.category, title='Cached', description='', price=1)
+
+    def test_hit(self):
+        first = self.client.get(f'/api/products/{self.product.pk}/')
+        # Changed without a signal, so the cached payload still stands
+        Product.objects.filter(pk=self.product.pk).update(price=2)
+        second = self.client.get(f'/api/products/{self.product.pk}/')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_invalidate(self):
+        first = self.client.get('/api/categories/')
+        Category.objects.create(name='Added')
+        second = self.client.get('/api/categories/')
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertIn('Added', json.dumps(second.json()))
+
+    def test_not_modified(self):
+        etag = self.client.get(f'/api/products/{self.product.pk}/')['ETag']
+        response = self.client.get(f'/api/products/{self.product.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.product.title = 'Renamed'
+        self.product.save()
+        self.assertEqual(self.client.get(f'/api/products/{self.product.pk}/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_process_local_cache_is_bypassed(self):
+        with override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'api': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        }):
+            self.assertIsNone(api_cache.api_cache())
+            self.client.get(f'/api/products/{self.product.pk}/')
+            # As a worker in another process would, which a local cache never hears about
+            Product.objects.filter(pk=self.product.pk).update(price=2)
+            self.assertEqual(self.client.get(f'/api/products/{self.product.pk}/').json()['price'], '2.00')
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import tempfile
+
+from django.conf import settings
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def probe_duration(source):
+    """Length of the video in seconds, or None when ffprobe cannot tell."""
+    result = subprocess.run(
+        [settings.FFPROBE_BINARY, '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', source],
+        capture_output=True, text=True
+    )
+    try:
+        return float(result.stdout.strip()) or None
+    except ValueError:
+        return None
+
+
+def run_ffmpeg(args, duration=None, on_progress=None):
+    """
+    Run ffmpeg with ``-progress pipe:1`` and report the fraction done as it
+    encodes, based on the out_time it prints against the source duration.
+    """
+    command = [settings.FFMPEG_BINARY, '-y', '-nostdin', '-loglevel', 'error', '-progress', 'pipe:1', '-nostats', *args]
+    # Errors go to a file rather than a second pipe: ffmpeg would block once it filled
+    # the pipe's buffer while we are still reading progress from stdout
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            # Older ffmpeg builds name the microsecond counter out_time_ms
+            if key in ('out_time_us', 'out_time_ms') and duration and on_progress and value.isdigit():
+                on_progress(min(int(value) / (duration * 1_000_000), 1.0))
+        if process.wait() != 0:
+            stderr.seek(0)
+            errors = stderr.read().decode(errors='replace')
+            raise TranscodeError(errors.strip() or f'ffmpeg exited with status {process.returncode}')
+
+
+def transcode(source, destination, rendition, duration=None, on_progress=None):
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    run_ffmpeg([
+        '-i', source,
+        '-vf', f"scale=-2:{rendition['height']}",
+        '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', rendition['video_bitrate'],
+        '-c:a', 'aac', '-b:a', rendition.get('audio_bitrate', '128k'),
+        '-threads', str(settings.FFMPEG_THREADS),
+        '-movflags', '+faststart',
+        destination,
+    ], duration=duration, on_progress=on_progress)
+
+
+def extract_poster(source, destination, duration=None):
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    # Grab the frame at VIDEO_POSTER_AT, or the first frame of very short clips
+    at = settings.VIDEO_POSTER_AT if duration is None or duration > settings.VIDEO_POSTER_AT else 0
+    run_ffmpeg(['-ss', str(at), '-i', source, '-frames:v', '1', destination])
@@ -1,7 +1,9 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView,TokenRefreshView
 from .views import RegisterView, LoginView, LogoutView, DashboardView
-from .views import  CategoryListCreateView, CategoryDetailView, ProductListCreateView, ProductDetailView, GenerateProductsView, upload_video
+from .views import  CategoryListCreateView, CategoryDetailView, ProductListCreateView, ProductDetailView, ProductProgressView, GenerateProductsView, GenerateProductsProgressView, upload_video, ExportProductsCSV
+from .views import ProductBulkView, ProductFacetsView, ProductSearchView, ProductVideoView, VideoUploadSessionCreateView, VideoUploadSessionView, VideoUploadCompleteView
+from . import async_views
 
 urlpatterns = [
 
@@ -18,9 +20,29 @@ urlpatterns = [
     path('categories/', CategoryListCreateView.as_view(), name='category-list-create'),
     path('categories/<int:pk>/', CategoryDetailView.as_view(), name='category-detail'),
     path('products/', ProductListCreateView.as_view(), name='product-list-create'),
+    path('products/bulk/', ProductBulkView.as_view(), name='product-bulk'),
+    path('products/search/', ProductSearchView.as_view(), name='product-search'),
+    path('products/facets/', ProductFacetsView.as_view(), name='product-facets'),
     path('products/<int:pk>/', ProductDetailView.as_view(), name='product-detail'),
+    path('products/<int:pk>/progress/', ProductProgressView.as_view(), name='product-progress'),
+
+    # Async read endpoints, for ASGI deployments
+    path('async/categories/', async_views.category_list, name='async-category-list'),
+    path('async/products/', async_views.product_list, name='async-product-list'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async-product-detail'),
+    path('async/products/<int:pk>/progress/', async_views.product_progress, name='async-product-progress'),
+    path('async/products/events/', async_views.product_events, name='async-product-events'),
+    path('async/products/<int:pk>/events/', async_views.product_events, name='async-product-events-detail'),
 
     path('generate-products/', GenerateProductsView.as_view(), name='generate-products'),
+    path('generate-products/<str:job_id>/', GenerateProductsProgressView.as_view(), name='generate-products-progress'),
     path('upload/video/<int:product_id>/', upload_video, name='upload-video'),
+    path('products/<int:pk>/video/uploads/', VideoUploadSessionCreateView.as_view(), name='video-upload-create'),
+    # After video/uploads/, which the rendition pattern would otherwise match
+    path('products/<int:pk>/video/', ProductVideoView.as_view(), name='product-video'),
+    path('products/<int:pk>/video/<str:rendition>/', ProductVideoView.as_view(), name='product-video-rendition'),
+    path('video/uploads/<uuid:pk>/', VideoUploadSessionView.as_view(), name='video-upload'),
+    path('video/uploads/<uuid:pk>/complete/', VideoUploadCompleteView.as_view(), name='video-upload-complete'),
+    path('export/products/csv/', ExportProductsCSV.as_view(), name='export-products-csv'),
 
 ]
\ No newline at end of file
@@ -1,36 +1,187 @@
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
 from base64 import b64encode, b64decode
+import hmac
+import re
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from e_commerce_proj.instrumentation import timed
+
+
+# Versioned ciphertext: $1$<key id>$<base64(iv + ciphertext)>. Older rows hold the bare base64.
+CIPHERTEXT_PREFIX = '$1$'
+
+
+def ciphertext_key_id(value):
+    """Id of the key ``value`` was encrypted with, or None for unversioned ciphertext."""
+    if value.startswith(CIPHERTEXT_PREFIX):
+        return value[len(CIPHERTEXT_PREFIX):].partition('$')[0]
+    return None
+
 
 class AESCipher:
     def __init__(self, key):
         self.block_size = AES.block_size
         self.key = sha256(key.encode()).digest()
+        # A fingerprint, so ciphertext names its key without giving anything about it away
+        self.key_id = hmac.new(self.key, b'key-id', sha256).hexdigest()[:8]
+        self.prefix = f'{CIPHERTEXT_PREFIX}{self.key_id}$'
 
-    def pad(self, s):
-        padding_length = self.block_size - len(s) % self.block_size
-        return s + chr(padding_length) * padding_length
+    def pad(self, data):
+        padding_length = self.block_size - len(data) % self.block_size
+        return data + bytes([padding_length]) * padding_length
 
-    def unpad(self, s):
-        return s[:-ord(s[len(s)-1:])]
+    def unpad(self, data):
+        padding_length = data[-1] if data else 0
+        if not 0 < padding_length <= self.block_size or data[-padding_length:] != bytes([padding_length]) * padding_length:
+            raise ValueError('Invalid padding.')
+        return data[:-padding_length]
 
+    @timed('crypto')
     def encrypt(self, raw):
-        raw = self.pad(raw)
         iv = get_random_bytes(self.block_size)
         cipher = AES.new(self.key, AES.MODE_CBC, iv)
-        encrypted_data = iv + cipher.encrypt(raw.encode())
-        encrypted_b64 = b64encode(encrypted_data).decode()
-        # print(f"Encrypted (Base64): {encrypted_b64}")
-        return b64encode(encrypted_data).decode()
+        encrypted_data = iv + cipher.encrypt(self.pad(raw.encode()))
+        return self.prefix + b64encode(encrypted_data).decode()
 
+    @timed('crypto')
     def decrypt(self, enc):
-        # print("@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@####################################",enc.encode())
+        key_id = ciphertext_key_id(enc)
+        if key_id is not None:
+            if key_id != self.key_id:
+                raise ValueError(f"Encrypted with key {key_id}, not {self.key_id}.")
+            enc = enc[len(self.prefix):]
         enc = b64decode(enc.encode())
-        # print("##################################################################",enc)
         iv = enc[:self.block_size]
-        print("iv", iv)
         cipher = AES.new(self.key, AES.MODE_CBC, iv)
-        decrypted_data = self.unpad(cipher.decrypt(enc[self.block_size:])).decode()
-        print(f"Decrypted: {decrypted_data}")
-        return decrypted_data
+        return self.unpad(cipher.decrypt(enc[self.block_size:])).decode()
+
+    def encrypt_many(self, values):
+        return _map_fields(self.encrypt, values)
+
+    def decrypt_many(self, values, raw_on_error=False):
+        if raw_on_error:
+            return _map_fields(lambda value: decrypt_or_raw(self, value), values)
+        return _map_fields(self.decrypt, values)
+
+
+class KeyRing(AESCipher):
+    """
+    Encrypts with the current key and decrypts with whichever configured key
+    a ciphertext names, so rows can be re-encrypted (products.rotation) while
+    reads go on. Unversioned ciphertext predates key ids and is read with the
+    oldest key, the one that was current before the first rotation.
+    """
+
+    def __init__(self, key, previous_keys=()):
+        super().__init__(key)
+        self.previous = [AESCipher(previous) for previous in previous_keys]
+        self.ciphers = {cipher.key_id: cipher for cipher in self.previous}
+        self.ciphers[self.key_id] = self
+        self.oldest = self.previous[-1] if self.previous else self
+
+    def decrypt(self, enc):
+        key_id = ciphertext_key_id(enc)
+        cipher = self.oldest if key_id is None else self.ciphers.get(key_id)
+        if cipher is None:
+            raise ValueError(f"Encryption key {key_id} is not configured.")
+        return AESCipher.decrypt(cipher, enc)
+
+
+def decrypt_or_raw(cipher, value):
+    if ciphertext_key_id(value) is not None:
+        # Versioned ciphertext is never plaintext: a missing key or a corrupt value must not be served as text
+        return cipher.decrypt(value)
+    # Rows written outside the API (e.g. generated dummy products) are stored in plaintext
+    try:
+        return cipher.decrypt(value)
+    except (ValueError, UnicodeDecodeError):
+        return value
+
+
+_ciphers = {}
+_ciphers_lock = threading.Lock()
+_executor = None
+_blind_index_keys = {}
+
+
+def get_cipher(key_id='default'):
+    """Return the shared KeyRing for ``key_id``, deriving its keys only once per process."""
+    cipher = _ciphers.get(key_id)
+    if cipher is None:
+        with _ciphers_lock:
+            cipher = _ciphers.get(key_id)
+            if cipher is None:
+                key = settings.ENCRYPTION_KEYS.get(key_id)
+                if not key:
+                    raise ImproperlyConfigured(f"Encryption key '{key_id}' is not configured.")
+                cipher = _ciphers[key_id] = KeyRing(key, settings.ENCRYPTION_PREVIOUS_KEYS.get(key_id, ()))
+    return cipher
+
+
+def _map_fields(func, values):
+    values = list(values)
+    workers = settings.ENCRYPTION_THREADS
+    if workers > 1 and len(values) >= settings.ENCRYPTION_PARALLEL_THRESHOLD:
+        global _executor
+        if _executor is None:
+            with _ciphers_lock:
+                if _executor is None:
+                    _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cipher')
+        return list(_executor.map(func, values))
+    return [func(value) for value in values]
+
+
+def _blind_index_key():
+    key = _blind_index_keys.get('default')
+    if key is None:
+        if settings.BLIND_INDEX_KEY:
+            key = sha256(settings.BLIND_INDEX_KEY.encode()).digest()
+        else:
+            cipher = get_cipher()
+            if cipher.previous:
+                # Digests keyed from a retiring key would all change once it is dropped (see products.checks)
+                raise ImproperlyConfigured('BLIND_INDEX_KEY must be set before ENCRYPTION_KEY is rotated.')
+            # Derive a separate key so index digests never reuse the encryption key directly
+            key = hmac.new(cipher.key, b'blind-index', sha256).digest()
+        _blind_index_keys['default'] = key
+    return key
+
+
+def normalize_for_index(value):
+    return ' '.join(value.casefold().split())
+
+
+def blind_index(value):
+    """Keyed HMAC of the normalized value, stable across encryptions of the same text."""
+    digest = hmac.new(_blind_index_key(), normalize_for_index(value).encode(), sha256)
+    return digest.hexdigest()[:32]
+
+
+def prefix_tokens(value):
+    """Word prefixes of ``value`` that prefix lookups can match against."""
+    tokens = set()
+    for word in re.findall(r'\w+', value.casefold()):
+        if len(word) <= settings.BLIND_INDEX_MIN_PREFIX:
+            tokens.add(word)
+            continue
+        longest = min(len(word), settings.BLIND_INDEX_MAX_PREFIX)
+        for length in range(settings.BLIND_INDEX_MIN_PREFIX, longest + 1):
+            tokens.add(word[:length])
+    return tokens
+
+
+@receiver(setting_changed)
+def clear_cipher_cache(setting, **kwargs):
+    if setting in ('ENCRYPTION_KEYS', 'ENCRYPTION_PREVIOUS_KEYS'):
+        _ciphers.clear()
+        _blind_index_keys.clear()
+    elif setting == 'BLIND_INDEX_KEY':
+        _blind_index_keys.clear()
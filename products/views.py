@@ -1,9 +1,11 @@
-from rest_framework import generics
+from rest_framework import generics, filters, pagination
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny
-from .models import Category, Product, UserProfile
-from .serializers import CategorySerializer, ProductSerializer, GenerateProductsSerializer
+from rest_framework.parsers import JSONParser
+from .models import Category, Product, UserProfile, VideoUploadSession
+from .serializers import CategorySerializer, ProductSerializer, GenerateProductsSerializer, ProductFilterSerializer, ProductExportSerializer, ProductSearchSerializer, VideoUploadSessionSerializer
+from .serializers import ProductFacetFilterSerializer, ProductFacetsSerializer
 from .permissions import IsAdminOrStaff, IsAdmin
 # from .utils import encrypt_data, decrypt_data
 
@@ -14,15 +16,33 @@ from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from .forms import UserRegistrationForm, UserLoginForm
 from django.contrib import messages
 
-from .utils import AESCipher
+from .fields import decrypt_fields
 import os
-
-from .tasks import generate_dummy_products, process_video
+import shutil
+import tempfile
+
+from .progress import get_generation_progress, get_progress, queue_generation
+from .storage import video_storage
+from .bulk import apply_operations
+from .parsers import NDJSONParser
+from . import cache as api_cache
+from . import counters
+from . import search
+from rest_framework.utils.urls import replace_query_param
 from django.shortcuts import render, redirect
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
 from django.shortcuts import get_object_or_404
-import csv
-from rest_framework import pagination
+from django.db import transaction
+from django.db.models import Q
+from e_commerce_proj.db_routers import read_alias, replica_reads
+import base64
+import json
+import re
+from collections import Counter
+import zlib
 
 class RegisterView(CreateView):
     form_class = UserRegistrationForm
@@ -64,6 +84,22 @@ class LogoutView(RedirectView):
         messages.info(self.request, 'You have been logged out.')
         return super().get(request, *args, **kwargs)
 
+def encode_cursor(product):
+    position = json.dumps([product.created_at.isoformat(), product.id])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = parse_datetime(created_at)
+    except (ValueError, TypeError):
+        return None
+    if created_at is None or not isinstance(pk, int):
+        return None
+    return created_at, pk
+
+
 class DashboardView(LoginRequiredMixin, TemplateView):
     template_name = ''
 
@@ -78,40 +114,94 @@ class DashboardView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        if self.request.user.role == 'staff':
-            context['products'] = Product.objects.filter(status='pending')
-        elif self.request.user.role == 'agent':
-            context['products'] = Product.objects.filter(created_by=self.request.user)
+        user = self.request.user
+        if user.role == 'admin':
+            context['facets'] = counters.facets()
+        elif user.role in ('staff', 'agent'):
+            products = Product.objects.select_related('category').only(
+                'id', 'title', 'status', 'price', 'created_at', 'category__name'
+            ).order_by('-created_at', '-id')
+            if user.role == 'agent':
+                products = products.filter(created_by=user)
+                context['products'] = self.page_of(products, 'page')
+            for product_status in self.dashboard_statuses:
+                context[f'{product_status}_products'] = self.page_of(
+                    products.filter(status=product_status), f'{product_status}_page'
+                )
         return context
 
-
-# Access the key from environment variable
-AES_KEY = os.getenv('ENCRYPTION_KEY')
-
-if not AES_KEY:
-    raise ValueError("AES Encryption key not found in environment variables")
-# print(AES_KEY)
-
-class CategoryListCreateView(generics.ListCreateAPIView):
+    dashboard_statuses = ('pending', 'approved', 'rejected', 'cancelled')
+
+    def page_of(self, queryset, param):
+        """
+        One page of ``queryset``, newest first, without a COUNT(*) or an OFFSET:
+        ``param`` carries a keyset cursor, ``after:`` the last row of the page
+        before or ``before:`` the first row of the page after. A row extra is
+        fetched to tell if there is more. Each category on the page is
+        decrypted once, however many of its products are listed.
+        """
+        size = settings.DASHBOARD_PAGE_SIZE
+        direction, _, cursor = self.request.GET.get(param, '').partition(':')
+        position = decode_cursor(cursor) if direction in ('after', 'before') else None
+        if position is None:
+            rows = list(queryset[:size + 1])
+            has_previous, has_next = False, len(rows) > size
+            rows = rows[:size]
+        else:
+            created_at, pk = position
+            if direction == 'after':
+                rows = list(queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))[:size + 1])
+                has_previous, has_next = True, len(rows) > size
+                rows = rows[:size]
+            else:
+                rows = list(
+                    queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+                    .reverse()[:size + 1]
+                )
+                has_previous, has_next = len(rows) > size, True
+                rows = rows[:size][::-1]
+
+        decrypt_fields(rows, ['title'])
+        categories = {}
+        for product in rows:
+            product.category = categories.setdefault(product.category_id, product.category)
+        decrypt_fields(list(categories.values()), ['name'])
+
+        # The other lists' cursors stay in the links, so paging one list leaves the rest where they are
+        query = self.request.GET.copy()
+        if has_previous and rows:
+            query[param] = f'before:{encode_cursor(rows[0])}'
+        else:
+            query.pop(param, None)
+        previous_query = query.urlencode()
+        if rows:
+            query[param] = f'after:{encode_cursor(rows[-1])}'
+        return {
+            'items': rows,
+            'has_previous': has_previous,
+            'has_next': has_next,
+            'previous_query': previous_query,
+            'next_query': query.urlencode(),
+        }
+
+
+class CachedReadMixin:
+    """Serve a read from the API cache, answering 304 when the client's ETag still matches."""
+
+    def cached_response(self, request, namespace, build):
+        entry = api_cache.get_or_build(namespace, build)
+        if entry['etag'] in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': entry['etag']})
+        return Response(entry['data'], headers={'ETag': entry['etag']})
+
+
+class CategoryListCreateView(CachedReadMixin, generics.ListCreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrStaff]
 
-    def create(self, request, *args, **kwargs):
-        cipher = AESCipher(AES_KEY)
-        # Encrypt the name field before saving it
-        if 'name' in request.data:
-            request.data['name'] = cipher.encrypt(request.data['name'])
-        return super().create(request, *args, **kwargs)
-
     def list(self, request, *args, **kwargs):
-        response = super().list(request, *args, **kwargs)
-        cipher = AESCipher(AES_KEY)
-        for category in response.data:
-            if 'name' in category:
-                # Decrypt the name field before returning it
-                category['name'] = cipher.decrypt(category['name'])
-        return Response(response.data)
+        return self.cached_response(request, 'categories', lambda: super(CategoryListCreateView, self).list(request, *args, **kwargs).data)
 
 
 class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -119,21 +209,37 @@ class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrStaff]
 
-    def retrieve(self, request, *args, **kwargs):
-        response = super().retrieve(request, *args, **kwargs)
-        cipher = AESCipher(AES_KEY)
-        if 'name' in response.data:
-            response.data['name'] = cipher.decrypt(response.data['name'])
-        return Response(response.data)
-
-    def update(self, request, *args, **kwargs):
-        cipher = AESCipher(AES_KEY)
-        if 'name' in request.data:
-            request.data['name'] = cipher.encrypt(request.data['name'])
-        return super().update(request, *args, **kwargs)
-
     def perform_destroy(self, instance):
-        instance.delete()
+        # Its products are deleted one signal at a time; their rollup changes go out as one task
+        # and they leave the search index in one write
+        with transaction.atomic(), counters.collect(), search.collect_removals():
+            instance.delete()
+
+
+def filter_products(queryset, options):
+    if 'status' in options:
+        queryset = queryset.filter(status=options['status'])
+    if 'category' in options:
+        queryset = queryset.filter(category_id=options['category'])
+    if 'min_price' in options:
+        queryset = queryset.filter(price__gte=options['min_price'])
+    if 'max_price' in options:
+        queryset = queryset.filter(price__lte=options['max_price'])
+    return queryset
+
+
+class ProductCursorPagination(pagination.CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        # Break ties on id so rows sharing a sort value keep a stable position
+        if len(ordering) == 1:
+            ordering = (ordering[0], '-id' if ordering[0].startswith('-') else 'id')
+        return ordering
 
 
 # Product Views
@@ -141,51 +247,120 @@ class ProductListCreateView(generics.ListCreateAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminOrStaff]
-
-    def create(self, request, *args, **kwargs):
-        cipher = AESCipher(AES_KEY)
-        if 'title' in request.data:
-            request.data['title'] = cipher.encrypt(request.data['title'])
-        if 'description' in request.data:
-            request.data['description'] = cipher.encrypt(request.data['description'])
-        return super().create(request, *args, **kwargs)
+    pagination_class = ProductCursorPagination
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['created_at', 'price']
+    ordering = ('-created_at', '-id')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method != 'GET':
+            return queryset
+        options = ProductFilterSerializer(data=self.request.query_params)
+        options.is_valid(raise_exception=True)
+        return filter_products(queryset, options.validated_data)
 
     def list(self, request, *args, **kwargs):
-        response = super().list(request, *args, **kwargs)
-        cipher = AESCipher(AES_KEY)
-        for product in response.data:
-            if 'title' in product:
-                product['title'] = cipher.decrypt(product['title'])
-            if 'description' in product:
-                product['description'] = cipher.decrypt(product['description'])
-        return Response(response.data)
+        with replica_reads():
+            return super().list(request, *args, **kwargs)
 
+    def perform_create(self, serializer):
+        # request.user is a token user, not a UserProfile row
+        serializer.save(created_by_id=self.request.user.pk)
 
-class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
+
+class ProductBulkView(generics.GenericAPIView):
+    """
+    Create, update and delete many products in one call. Takes a JSON array or
+    NDJSON stream of operations (see products.bulk) and answers with one result
+    per operation, in order.
+    """
+    permission_classes = [IsAdminOrStaff]
+    parser_classes = [JSONParser, NDJSONParser]
+
+    def post(self, request, *args, **kwargs):
+        operations = request.data
+        if isinstance(operations, dict) or isinstance(operations, str):
+            return Response({"error": "Expected a list of operations."}, status=status.HTTP_400_BAD_REQUEST)
+        results = list(apply_operations(operations, user=request.user))
+        summary = Counter(result['status'] for result in results)
+        return Response({"summary": summary, "results": results})
+
+
+class ProductSearchView(generics.GenericAPIView):
+    """
+    Products matching every word of ``q`` (as word prefixes) in their title or
+    description, best match first, optionally filtered like the product list.
+    """
+    serializer_class = ProductSearchSerializer
+    permission_classes = [IsAdminOrStaff]
+
+    def get(self, request, *args, **kwargs):
+        options = self.get_serializer(data=request.query_params)
+        options.is_valid(raise_exception=True)
+        options = options.validated_data
+        matches = search.search_index().search(
+            options['q'],
+            category=options.get('category'),
+            status=options.get('status'),
+            min_price=options.get('min_price'),
+            max_price=options.get('max_price'),
+            limit=options['limit'] + 1,
+            offset=options['offset'],
+        )
+        has_next = len(matches) > options['limit']
+        matches = matches[:options['limit']]
+
+        products = Product.objects.in_bulk([pk for pk, _ in matches])
+        # Rows deleted since they were indexed are skipped
+        found = [(products[pk], score) for pk, score in matches if pk in products]
+        decrypt_fields([product for product, _ in found], ['title', 'description'])
+        results = ProductSerializer([product for product, _ in found], many=True, context=self.get_serializer_context()).data
+        for result, (_, score) in zip(results, found):
+            result['score'] = round(-score, 4)
+
+        next_url = None
+        if has_next:
+            next_url = replace_query_param(request.build_absolute_uri(), 'offset', options['offset'] + options['limit'])
+        return Response({"next": next_url, "results": results})
+
+
+class ProductDetailView(CachedReadMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminOrStaff]
 
     def retrieve(self, request, *args, **kwargs):
-        response = super().retrieve(request, *args, **kwargs)
-        cipher = AESCipher(AES_KEY)
-        if 'title' in response.data:
-            response.data['title'] = cipher.decrypt(response.data['title'])
-        if 'description' in response.data:
-            response.data['description'] = cipher.decrypt(response.data['description'])
-        return Response(response.data)
-
-    def update(self, request, *args, **kwargs):
-        cipher = AESCipher(AES_KEY)
-        if 'title' in request.data:
-            request.data['title'] = cipher.encrypt(request.data['title'])
-        if 'description' in request.data:
-            request.data['description'] = cipher.encrypt(request.data['description'])
-        return super().update(request, *args, **kwargs)
+        return self.cached_response(request, f"product:{kwargs['pk']}", lambda: super(ProductDetailView, self).retrieve(request, *args, **kwargs).data)
 
     def perform_destroy(self, instance):
         instance.delete()
 
+class ProductFacetsView(generics.GenericAPIView):
+    """
+    Product count and min/max/average price per status and per category, read
+    from the ProductCount rollups. ``?category=`` narrows the status facet and
+    ``?status=`` the category facet.
+    """
+    serializer_class = ProductFacetFilterSerializer
+    permission_classes = [IsAdminOrStaff]
+
+    def get(self, request, *args, **kwargs):
+        options = self.get_serializer(data=request.query_params)
+        options.is_valid(raise_exception=True)
+        facets = counters.facets(**options.validated_data)
+        return Response(ProductFacetsSerializer(facets).data)
+
+class ProductProgressView(generics.GenericAPIView):
+    permission_classes = [IsAdminOrStaff]
+
+    def get(self, request, pk, *args, **kwargs):
+        progress = get_progress(pk)
+        if progress is None:
+            return Response({"error": "Product not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(progress)
+
+
 class GenerateProductsView(generics.GenericAPIView):
     serializer_class = GenerateProductsSerializer
     permission_classes = [AllowAny]
@@ -198,13 +373,30 @@ class GenerateProductsView(generics.GenericAPIView):
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
+            from .tasks import generate_dummy_products
             num_products = serializer.validated_data['num_products']
-            generate_dummy_products.delay(num_products)
+            result = generate_dummy_products.delay(
+                num_products,
+                batch_size=serializer.validated_data.get('batch_size'),
+                workers=serializer.validated_data['workers']
+            )
+            queue_generation(result.id, num_products)
             return Response(
-                {"message": f"Task to generate {num_products} products has been initiated."},
+                {"message": f"Task to generate {num_products} products has been initiated.", "job_id": result.id},
                 status=status.HTTP_202_ACCEPTED
             )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class GenerateProductsProgressView(generics.GenericAPIView):
+    """Status and number of products inserted so far of a generate-products job."""
+    permission_classes = [AllowAny]
+
+    def get(self, request, job_id, *args, **kwargs):
+        progress = get_generation_progress(job_id)
+        if progress is None:
+            return Response({"error": "Job not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(progress)
     
 def upload_video(request, product_id):
     product = get_object_or_404(Product, id=product_id)
@@ -212,40 +404,219 @@ def upload_video(request, product_id):
     if request.method == 'POST':
         video_file = request.FILES.get('video')
         if video_file:
-            # Save the uploaded file to the model
-            product.video.save(video_file.name, video_file)
-            
-            # Enqueue the video processing task
-            process_video.delay(product_id=product.id, video_file_path=product.video.path)
-            
+            # Save the uploaded file to the model; trigger_video_processing enqueues it
+            product.video.save(video_file.name, video_file, save=False)
+            product.video_status = 'pending'
+            product.video_progress = 0
+            product.save()
+
             return Response({"message": "Video upload successful, processing started."}, status=status.HTTP_202_ACCEPTED)
         return Response({"error": "No video file provided."}, status=status.HTTP_400_BAD_REQUEST)
-    
 
-class ProductPagination(pagination.PageNumberPagination):
-    page_size = 1000  
+
+class ProductVideoView(generics.GenericAPIView):
+    """
+    Play a product's uploaded video, one of its renditions (``video/720p/``)
+    or its poster (``video/poster/``). The video storage answers: a sendfile
+    header or an object store redirect, or a Range-aware stream from Python.
+
+    Admins and staff can play any product's video. Everyone else, anonymous
+    included since <video> elements cannot send a token, only gets the videos
+    of approved products; the rest are a 404, not a 403, so that pks of
+    unreviewed products cannot be probed.
+    """
+    queryset = Product.objects.only('video', 'video_poster', 'video_renditions')
+    permission_classes = [AllowAny]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if IsAdminOrStaff().has_permission(self.request, self):
+            return queryset
+        return queryset.filter(status='approved')
+
+    def get(self, request, pk, rendition=None, *args, **kwargs):
+        product = self.get_object()
+        if rendition is None:
+            name = product.video.name
+        elif rendition == 'poster':
+            name = product.video_poster.name
+        else:
+            name = product.video_renditions.get(rendition)
+        if not name:
+            return Response({"error": "No such video."}, status=status.HTTP_404_NOT_FOUND)
+        return video_storage().serve(request, name)
+
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class VideoUploadSessionCreateView(generics.CreateAPIView):
+    serializer_class = VideoUploadSessionSerializer
+    permission_classes = [IsAdminOrStaff]
+
+    def perform_create(self, serializer):
+        product = get_object_or_404(Product, pk=self.kwargs['pk'])
+        serializer.save(product=product)
+
+
+class VideoUploadSessionView(generics.RetrieveAPIView):
+    """GET reports how many bytes arrived so a client can resume; PUT appends a byte range."""
+    queryset = VideoUploadSession.objects.filter(completed=False)
+    serializer_class = VideoUploadSessionSerializer
+    permission_classes = [IsAdminOrStaff]
+
+    def put(self, request, *args, **kwargs):
+        session = self.get_object()
+        match = CONTENT_RANGE.match(request.headers.get('Content-Range', ''))
+        if not match:
+            return Response({"error": "Content-Range header 'bytes start-end/size' is required."}, status=status.HTTP_400_BAD_REQUEST)
+        start, end, size = (int(value) for value in match.groups())
+        if size != session.size or start > end or end >= size:
+            return Response({"error": "Content-Range does not fit the declared video size."}, status=status.HTTP_400_BAD_REQUEST)
+        if start > session.received:
+            return Response({"error": "Chunk leaves a gap.", "received": session.received}, status=status.HTTP_409_CONFLICT)
+
+        # The body goes to a scratch file first, so the session row is only locked for the
+        # short append below, never while the client is still sending
+        path = session.partial_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.TemporaryFile(dir=os.path.dirname(path)) as chunk:
+            remaining = end + 1 - start
+            while remaining > 0:
+                data = request.stream.read(min(settings.VIDEO_UPLOAD_BUFFER_SIZE, remaining)) if request.stream else b''
+                if not data:
+                    break
+                chunk.write(data)
+                remaining -= len(data)
+            chunk_end = start + chunk.tell()
+
+            with transaction.atomic():
+                # Overlapping PUTs (a retry while the first is still sending) take turns here,
+                # each appending from wherever the other left off
+                session = get_object_or_404(self.get_queryset().select_for_update(), pk=session.pk)
+                if start > session.received:
+                    return Response({"error": "Chunk leaves a gap.", "received": session.received}, status=status.HTTP_409_CONFLICT)
+                # Bytes before `received` already landed in an earlier (retried) request
+                if chunk_end > session.received:
+                    chunk.seek(session.received - start)
+                    with open(path, 'r+b' if os.path.exists(path) else 'wb') as partial:
+                        partial.seek(session.received)
+                        shutil.copyfileobj(chunk, partial, settings.VIDEO_UPLOAD_BUFFER_SIZE)
+                        partial.truncate()
+                    session.received = chunk_end
+                    session.save(update_fields=['received'])
+        return Response(self.get_serializer(session).data)
+
+
+class VideoUploadCompleteView(generics.GenericAPIView):
+    queryset = VideoUploadSession.objects.filter(completed=False).select_related('product')
+    serializer_class = VideoUploadSessionSerializer
+    permission_classes = [IsAdminOrStaff]
+
+    def post(self, request, *args, **kwargs):
+        session = self.get_object()
+        if session.received != session.size:
+            return Response({"error": "Upload is incomplete.", "received": session.received}, status=status.HTTP_409_CONFLICT)
+
+        product = session.product
+        field = Product._meta.get_field('video')
+        name = field.storage.get_available_name(field.generate_filename(product, session.filename))
+        # A rename for local storage: the partial file sits on the same disk
+        field.storage.store(session.partial_path, name)
+
+        product.video.name = name
+        product.video_status = 'pending'
+        product.video_progress = 0
+        # trigger_video_processing enqueues process_video once this commits
+        product.save(update_fields=['video', 'video_status', 'video_progress', 'updated_at'])
+        session.completed = True
+        session.save(update_fields=['completed'])
+        return Response({"message": "Video upload complete, processing started."}, status=status.HTTP_202_ACCEPTED)
+
+
+class Echo:
+    """Pseudo-buffer for csv.writer that hands each written row straight back."""
+    def write(self, value):
+        return value
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
 
 class ExportProductsCSV(generics.GenericAPIView):
     permission_classes = [IsAdmin]
-    pagination_class = ProductPagination
+    serializer_class = ProductExportSerializer
+    columns = {
+        'id': 'ID',
+        'category': 'Category',
+        'title': 'Title',
+        'description': 'Description',
+        'price': 'Price',
+        'status': 'Status',
+        'created_at': 'Created At',
+        'updated_at': 'Updated At',
+    }
 
     def get(self, request, *args, **kwargs):
-        paginator = self.pagination_class()
-        products = Product.objects.all()
-        paginated_products = paginator.paginate_queryset(products, request)
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="products.csv"'
-        writer = csv.writer(response)
-        writer.writerow(['ID', 'Category', 'Title', 'Description', 'Price', 'Status', 'Created At', 'Updated At'])
-        for product in paginated_products:
-            writer.writerow([
-                product.id,
-                product.category.name,
-                product.title,
-                product.description,
-                product.price,
-                product.status,
-                product.created_at,
-                product.updated_at
-            ])
-        return response
\ No newline at end of file
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+
+        columns = options.get('columns') or list(self.columns)
+        unknown = [column for column in columns if column not in self.columns]
+        if unknown:
+            return Response({"columns": f"Unknown columns: {', '.join(unknown)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Pinned to the replica here: the rows are fetched while the response streams
+        queryset = filter_products(Product.objects.using(read_alias()).select_related('category').order_by('id'), options)
+        rows = self.iter_csv(queryset, columns)
+        if options.get('compress') == 'gzip':
+            response = StreamingHttpResponse(gzip_stream(rows), content_type='application/gzip')
+            response['Content-Disposition'] = 'attachment; filename="products.csv.gz"'
+        else:
+            response = StreamingHttpResponse(rows, content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="products.csv"'
+        return response
+
+
+    def iter_batches(self, queryset):
+        # Keyset pagination on id keeps every batch an index seek, however deep the export goes
+        last_id = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:settings.PRODUCT_EXPORT_CHUNK_SIZE])
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1].id
+
+    def iter_csv(self, queryset, columns):
+        import csv
+        writer = csv.writer(Echo())
+        yield writer.writerow([self.columns[column] for column in columns])
+
+        category_names = {}
+        encrypted_columns = [column for column in ('title', 'description') if column in columns]
+        for batch in self.iter_batches(queryset):
+            decrypt_fields(batch, encrypted_columns)
+            lines = []
+            for product in batch:
+                if product.category_id not in category_names:
+                    category_names[product.category_id] = product.category.name
+                values = {
+                    'id': product.id,
+                    'category': category_names[product.category_id],
+                    'title': product.title if 'title' in columns else '',
+                    'description': product.description if 'description' in columns else '',
+                    'price': product.price,
+                    'status': product.status,
+                    'created_at': product.created_at,
+                    'updated_at': product.updated_at,
+                }
+                lines.append(writer.writerow([values[column] for column in columns]))
+            yield ''.join(lines)